@@ -1,92 +1,147 @@
 import pandas as pd
 import numpy as np
-import yfinance as yf
-from indicators import *
-from sklearn.preprocessing import StandardScaler
+from indicators import raw_indicators, indicator_stats, normalize_indicators, StreamingIndicators
+from signals import trade_signals
+from price_store import default_store, BAR_MINUTES
+from model_registry import default_registry, default_prediction_cache
+from model_artifact import LinearModel, ScalerParams, is_linear
+from instrumentation import timed, span
 from dateutil.relativedelta import relativedelta
-from joblib import dump,load
 import datetime as dt
 import os
 
 class MLTrader:
     """
-        class for making daily predictions of a given stock's price
+        class for making daily (or intraday) predictions of a given stock's
+        price
 
         inputs:
             learner: ML object to be trained and used for prediction
                      must have fit(X,Y) and predict(X) methods
             impact:  float representing the assumed (and simplified) impact that
                      a trade will have on the price of the stock
-            n:       integer representing the length of the rollling windows for
-                     generating the indictors
-            kwargs:  dictionary containing the arguments to feed into the ML
-                     learner object
+            n:        integer representing the length of the rollling windows
+                      for generating the indictors in bars
+            kwargs:   dictionary containing the arguments to feed into the ML
+                      learner object
+            store:    PriceStore to read the price data from (defaults to the
+                      shared store of the interval in price_store.py)
+            interval: string representing the bar interval ("1d" or an
+                      intraday interval like "1m", "5m", "1h"; see
+                      price_store.BAR_MINUTES); ignored if a store is given
     """
 
-    def __init__(self, learner, impact = 0.0, n = 9, kwargs = {}):
+    def __init__(self, learner, impact = 0.0, n = 9, kwargs = {}, store = None,
+                 interval = "1d"):
         self.learner = None if learner is None else learner(**kwargs)
         self.impact = impact
         self.n = n
+        self.store = default_store(interval) if store is None else store
+        self.interval = self.store.interval
         #storing sklearn's standard scaler for scaling the train and test prices
-        self.ss = StandardScaler()
+        #(created on the first fit, so predicting never imports sklearn)
+        self.ss = None
+        #normalization statistics of the training indicators (see
+        #indicators.indicator_stats) reused when predicting
+        self.indicator_stats = None
+        #(learner, StandardScaler, indicator stats) triple of each stock in
+        #the portfolio (see fit_portfolio and load_portfolio)
+        self.portfolio = {}
+        #reason each stock left out of the last batched fit couldn't be
+        #trained (see fit_many)
+        self.fit_errors = {}
+        #(symbols, models, scaler means/scales, StreamingIndicators) of the
+        #bar-by-bar predictions (see start_streaming)
+        self._stream = None
         #counter variables to track the total number of total and bad trades
         self.trades = 0
         self.bad_trades = 0
 
 
+    @timed()
     def preprocess_data(self, symbol, sd, ed):
         """
             helper method for reading in and preprocessing the prices data
 
             inputs:
-                symbol: string representing the stock symbol for trading
+                symbol: string representing the stock symbol for trading (or
+                        a list of stock symbols)
                 sd:     string representing the date to start trading
                 ed:     string representing the date to stop trading
 
             output:
-                prices: dataframe containing the preprocessed daily price data
-                        for the given stock
+                prices: dataframe containing the preprocessed price data (one
+                        row per bar, in the store's dtype) for the given
+                        stock(s)
         """
-        #creating a list with the input symbol and "SPY" to pull in all days
+        #creating a list with the input symbol(s) and "SPY" to pull in all bars
         #the stock market was open
-        symbols = [symbol, "SPY"]
+        items = list(symbol) if isinstance(symbol, (list, tuple)) else [symbol]
+        symbols = list(dict.fromkeys(items + ["SPY"]))
 
-        #reading in the stock data using util.py and removing nulls
-        df = yf.download(symbols, start=sd, end=ed, auto_adjust=True)
-        prices = df['Close'].filter(items=[symbol], axis=1)
+        #reading in the stock data from the price store as one 2D array
+        timestamps, closes = self.store.get_arrays(symbols, sd, ed)
+        closes = closes[:, [symbols.index(item) for item in items]]
 
-        prices.fillna(method='ffill', inplace=True) #forward-filling missing prices
-        prices.fillna(method='bfill', inplace=True) #back-filling missing prices
-        return prices
+        #forward-filling and then back-filling missing prices of each stock
+        if len(closes):
+            rows = np.arange(len(closes)).reshape(-1, 1)
+            filled = np.maximum.accumulate(np.where(np.isnan(closes), 0, rows), axis=0)
+            closes = np.take_along_axis(closes, filled, axis=0)
+            first = np.argmax(~np.isnan(closes), axis=0)
+            closes = np.where(np.isnan(closes), closes[first, np.arange(closes.shape[1])], closes)
+
+        return pd.DataFrame(closes, columns=items,
+                            index=pd.DatetimeIndex(timestamps.view('datetime64[ns]'), name='Date'))
 
 
-    def generate_indicators(self, prices):
+    def generate_indicators(self, prices, stats = None):
         """
             helper method for generating features dataframe containing the
             training indicators
 
             input:
                 prices:        dataframe containing the daily prices of a stock
+                stats:         normalization statistics of the indicators (see
+                               indicators.indicator_stats); defaults to the
+                               statistics of the given prices
 
             output:
                 indicators_df: dataframe containing the Price/SMA Ratio,
                                Bollinger Bands, and Volatility of the daily
                                stock prices
         """
-        #creating the indicator dfs
-        price_sma_df = price_sma_ratio(prices, self.n)
-        bb_df = bollinger_bands(prices, self.n)
-        vol_df = volatility(prices, self.n)
+        return self.generate_indicators_many(prices, stats)[prices.columns[0]]
 
-        #creating features dataframe for training the regressor
-        indicators_df = price_sma_df.join(bb_df,rsuffix="1") \
-                                    .join(vol_df,rsuffix="2")
-        indicators_df.columns = ["Price/SMA", "Bollinger Bands", "Volatility"]
 
-        #adding column for the closing price of one days prior
-        indicators_df["Previous Price"] = prices.shift(1).values
+    @timed()
+    def generate_indicators_many(self, prices, stats = None):
+        """
+            helper method for generating the features dataframes of many
+            stocks from one pass of the fused indicator kernel
 
-        return indicators_df
+            input:
+                prices:     dataframe containing the daily prices of one
+                            stock per column
+                stats:      normalization statistics of the indicators (see
+                            indicators.indicator_stats); stocks missing from
+                            them are normalized with the statistics of the
+                            given prices
+
+            output:
+                features:   dictionary mapping each stock symbol to its
+                            features dataframe (see generate_indicators)
+        """
+        indicators = raw_indicators(prices, self.n)
+        indicators = normalize_indicators(indicators, _fill_stats(indicators, stats))
+        features = {}
+        for symbol in prices.columns:
+            #creating features dataframe for training the regressor
+            indicators_df = indicators.xs(symbol, axis=1, level=1).copy()
+            #adding column for the closing price of one days prior
+            indicators_df["Previous Price"] = prices[symbol].shift(1).values
+            features[symbol] = indicators_df
+        return features
 
 
     def generate_orders_df(self, trades_df, symbol):
@@ -129,41 +184,252 @@ class MLTrader:
         """
         #reading in the price data
         prices = self.preprocess_data(symbol, sd, ed)
+        self.fit_prices(prices)
+
+
+    @timed()
+    def fit_prices(self, prices):
+        """
+            method for training the given ML regressor object on an already
+            preprocessed dataframe of prices (see preprocess_data)
+
+            input:
+                prices: dataframe containing the daily prices of a stock
+
+            output:
+                None
+        """
+        features, targets = self.train_features(prices)
+        #training regressor to predict prices using the indicators in indicators.py
+        self.learner.fit(features, targets)
+
+
+    def train_features(self, prices):
+        """
+            method for fitting the StandardScaler and indicator statistics on
+            a dataframe of prices and returning the training features and
+            targets (without training the learner, so they can be reused for
+            many learners)
+
+            input:
+                prices:   dataframe containing the daily prices of a stock
+
+            output:
+                features: 2D array containing the indicators and previous price
+                          of each trading day
+                targets:  2D array containing the normalized price of each
+                          trading day
+        """
         #normalizing the prices
-        prices_norm = pd.DataFrame(self.ss.fit_transform(prices),index=prices.index, columns=[symbol])
+        if self.ss is None:
+            from sklearn.preprocessing import StandardScaler
+            self.ss = StandardScaler()
+        prices_norm = pd.DataFrame(self.ss.fit_transform(prices),index=prices.index,
+                                   columns=prices.columns)
+        #saving the normalization statistics of the indicators so predictions
+        #scale their features the same way as the training features
+        self.indicator_stats = indicator_stats(raw_indicators(prices_norm, self.n))
         #generating indicator dataframe for predicting
-        features_df = self.generate_indicators(prices_norm).fillna(method='bfill')
-        #training regressor to predict prices using the indicators in indicators.py
-        self.learner.fit(features_df.values, prices_norm.values)
+        features_df = self.generate_indicators(prices_norm, self.indicator_stats) \
+                          .fillna(method='bfill')
+        return features_df.values, prices_norm.values
 
 
+    def fit_many(self, symbols, sd, ed, alpha = 1.0, pooled = False):
+        """
+            method for training ridge regression models for many stocks in one
+            batched solve instead of one scikit-learn fit per stock
+
+            inputs:
+                symbols: list of strings representing the stock symbols
+                sd:      string representing the date to start trading
+                ed:      string representing the date to stop trading
+                alpha:   float representing the ridge regularization strength
+                pooled:  boolean indicating whether to fit one model shared by
+                         every stock instead of one model per stock
+
+            output:
+                traders: dictionary mapping each stock symbol to a trained
+                         MLTrader (with the same impact, n, and price store)
+                         that can be used with predict_today, testLearner,
+                         and save_learner; stocks that can't be trained (e.g.
+                         without prices) are left out, and the reason is kept
+                         in the fit_errors dictionary
+        """
+        #reading in the price data of every symbol at once
+        prices = self.preprocess_data(list(symbols), sd, ed)
+        return self.fit_many_prices(prices, alpha, pooled)
+
+
+    @timed()
+    def fit_many_prices(self, prices, alpha = 1.0, pooled = False):
+        """
+            method for training the batched ridge regression models (see
+            fit_many) on an already preprocessed dataframe of prices with one
+            stock per column
+        """
+        #normalizing each stock's prices like StandardScaler
+        ss_mean = prices.mean().values
+        ss_scale = prices.std(ddof=0).replace(0, 1).values
+        prices_norm = (prices - ss_mean) / ss_scale
+
+        #generating the (stocks x days x features) tensor and the targets
+        stats = indicator_stats(raw_indicators(prices_norm, self.n))
+        features = self.generate_indicators_many(prices_norm, stats)
+        X = np.stack([features[symbol].fillna(method='bfill').values
+                      for symbol in prices.columns])
+        y = prices_norm.values.T
+
+        #leaving the stocks whose features or targets aren't all finite (e.g. a
+        #stock without prices) out of the solve, so one bad column can't turn
+        #the other stocks' (or the pooled) coefficients into NaN
+        symbols = list(prices.columns)
+        good = np.isfinite(X).all(axis=(1, 2)) & np.isfinite(y).all(axis=1)
+        self.fit_errors = {symbol: "no finite prices/features to train on"
+                           for symbol, ok in zip(symbols, good) if not ok}
+        rows = np.flatnonzero(good)
+        if len(rows) == 0:
+            return {}
+        X, y = X[rows], y[rows]
+        if pooled:
+            X, y = X.reshape(1, -1, X.shape[2]), y.reshape(1, -1)
+
+        #solving every stock's ridge regression at once on the centered data
+        #(the intercept isn't regularized, matching scikit-learn's Ridge)
+        X_mean, y_mean = X.mean(axis=1), y.mean(axis=1)
+        X_c = X - X_mean[:, None, :]
+        y_c = y - y_mean[:, None]
+        gram = np.einsum('stf,stg->sfg', X_c, X_c) + alpha*np.eye(X.shape[2])
+        coef = np.linalg.solve(gram, np.einsum('stf,st->sf', X_c, y_c)[..., None])[..., 0]
+        intercept = y_mean - (X_mean*coef).sum(axis=1)
+        solved = np.isfinite(coef).all(axis=1) & np.isfinite(intercept)
+
+        traders = {}
+        for j, i in enumerate(rows):
+            symbol = symbols[i]
+            k = 0 if pooled else j
+            if not solved[k]:
+                self.fit_errors[symbol] = "the ridge solve gave non-finite coefficients"
+                continue
+            trader = MLTrader(None, impact=self.impact, n=self.n, store=self.store)
+            trader.learner = LinearModel(coef[k], intercept[k])
+            trader.ss = ScalerParams(ss_mean[i:i+1], ss_scale[i:i+1])
+            trader.indicator_stats = stats.loc[(slice(None), symbol), :]
+            traders[symbol] = trader
+        return traders
+
+
+    @timed()
     def save_learner(self, symbol = ""):
         """
             method that saves the learner using joblib
             assumes that the model is from scikit-learn
+            the files are replaced atomically so it's safe to call from
+            parallel training processes
         """
-        #creating models folder if it doesn't already exist
+        #creating models folder if it doesn't already exist (other processes
+        #may be creating it at the same time)
+        from joblib import dump
         folder_path = os.path.join(os.getcwd(), "models")
-        if not os.path.isdir(folder_path):
-             os.mkdir(folder_path)
+        os.makedirs(folder_path, exist_ok=True)
 
-        #dumping the ML model and StandardScaler objects into the models folder
-        dump(self.learner, os.path.join(folder_path, "{}_model.joblib".format(symbol)))
-        dump(self.ss, os.path.join(folder_path, "{}_ss.joblib".format(symbol)))
+        #dumping the ML model, StandardScaler, and indicator statistics into the
+        #models folder; each file is written to a temporary file first and then
+        #swapped in so readers never load a partially written model
+        for obj, name in [(self.learner, "model"), (self.ss, "ss"),
+                          (self.indicator_stats, "stats")]:
+            path = os.path.join(folder_path, "{}_{}.joblib".format(symbol, name))
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            dump(obj, tmp_path)
+            os.replace(tmp_path, path)
 
 
-    def load_learner(self, symbol = ""):
+    @timed()
+    def load_learner(self, symbol = "", registry = None):
         """
             method that loads the learner using joblib
             assumes that the model was saved using save_learner method
+            if a ModelRegistry is given, the learner and StandardScaler are
+            taken from its cache (shared objects, only use them for predicting)
+            models saved without indicator statistics normalize their
+            features with the statistics of the prediction window
         """
+        if registry is not None:
+            self.learner, self.ss, self.indicator_stats = registry.get(symbol, self.n)
+            return
+        from joblib import load
         self.learner = load("models/{}_model.joblib".format(symbol))
         self.ss = load("models/{}_ss.joblib".format(symbol))
+        stats_path = "models/{}_stats.joblib".format(symbol)
+        self.indicator_stats = load(stats_path) if os.path.isfile(stats_path) else None
+
+
+    @timed()
+    def _predict_window(self, prices, models):
+        """
+            helper method for predicting today's price of each stock from a
+            window of its recent prices
+
+            inputs:
+                prices:      dataframe containing the recent daily prices of
+                             one stock per column
+                models:      dictionary mapping each stock symbol to its
+                             (learner, StandardScaler, indicator stats) triple
+
+            output:
+                predictions: dictionary mapping each stock symbol to its
+                             predicted closing price
+        """
+        #normalizing each stock's prices with its own StandardScaler
+        prices_norm = pd.DataFrame(index=prices.index)
+        for symbol, (learner, ss, stats) in models.items():
+            prices_norm[symbol] = ss.transform(prices[[symbol]])[:,0]
+
+        #generating indicator dataframes for all stocks in one pass using the
+        #saved normalization statistics of each stock
+        saved_stats = [stats for _, _, stats in models.values() if stats is not None]
+        features = self.generate_indicators_many(
+            prices_norm, pd.concat(saved_stats) if saved_stats else None)
+
+        predictions = {}
+        for symbol, (learner, ss, stats) in models.items():
+            #skipping the n days of blanks and predicting the first full day
+            features_df = features[symbol].iloc[[self.n],:]
+            with span("MLTrader.learner_predict"):
+                prices_array = learner.predict(features_df.values).reshape(-1, 1)
+            predictions[symbol] = ss.inverse_transform(prices_array)[0,0]
+        return predictions
+
+
+    def _today_window(self):
+        if self.interval != "1d":
+            #ending at the last completed bar and going back enough sessions
+            #for 2*window-length bars plus a weekend and a holiday
+            bars_per_session = -(-BAR_MINUTES["1d"] // BAR_MINUTES[self.interval])
+            ed = self.store.completed_until()
+            sd = ed - relativedelta(days=2 * -(-2*self.n // bars_per_session) + 3)
+            return sd, ed
+        #finding the start_date based on the 2*window-length to account for
+        #days the market isn't open
+        ed = dt.datetime.today() - relativedelta(days=1)
+        sd = ed - relativedelta(days=self.n*2)
+        return sd, ed
+
+
+    def _today_prices(self, symbols):
+        #reading in the recent prices data the predictions are made from
+        sd, ed = self._today_window()
+        prices = self.preprocess_data(symbols, sd, ed)
+        if self.interval != "1d":
+            #predicting the next bar from the window ending at the last bar
+            prices = prices.iloc[-(self.n+1):]
+        return prices
 
 
     def predict_today(self, symbol):
         """
-            method to predict the adjusted closing stock price for today
+            method to predict the adjusted closing stock price for today (or
+            for the next bar of an intraday interval)
 
             input:
                 symbol: string representing the stock symbol for trading
@@ -172,91 +438,367 @@ class MLTrader:
                 price:  float representing today's predicted closing stock price
                         for the given symbol
         """
-        #finding the start_date based on the 2*window-length to account for
-        #days the market isn't open
-        ed = dt.datetime.today() - relativedelta(days=1)
-        sd = ed - relativedelta(days=self.n*2)
+        #reading in the prices data and predicting with the loaded learner
+        prices = self._today_prices(symbol)
+        models = {symbol: (self.learner, self.ss, self.indicator_stats)}
+        return self._predict_window(prices, models)[symbol]
 
-        #reading in the prices data and normalizing it
-        prices = self.preprocess_data(symbol, sd, ed)
-        prices_norm = pd.DataFrame(self.ss.transform(prices),index=prices.index,
-                                   columns=[symbol])
 
-        #generating indicator dataframe for predicting
-        features_df = self.generate_indicators(prices_norm)
+    @timed()
+    def predict_many(self, symbols, registry = None, cache = None):
+        """
+            method to predict today's adjusted closing stock price for many
+            stocks in one batched pass over shared price data; predictions are
+            cached by (symbol, model version, last bar date), so they're only
+            recomputed after a new bar arrives or a model is retrained
 
-        #removing the n days of blanks from prices and features_df
-        prices_norm = prices_norm.iloc[self.n:,:]
-        features_df = features_df.iloc[self.n:,:]
+            inputs:
+                symbols:     list of strings representing the stock symbols
+                registry:    ModelRegistry to load the models from (defaults to
+                             the shared registry in model_registry.py)
+                cache:       PredictionCache to read/store the predictions
+                             (defaults to the shared cache in model_registry.py)
 
-        #predicting prices using Random Forest regressor
-        prices_array = self.learner.predict(features_df.values)
-        price = self.ss.inverse_transform(prices_array)[0,0]
-        return price
+            output:
+                predictions: dictionary mapping each stock symbol to today's
+                             predicted closing price
+        """
+        registry = default_registry() if registry is None else registry
+        cache = default_prediction_cache() if cache is None else cache
+
+        #reading in the prices data for every symbol at once
+        prices = self._today_prices(list(symbols))
+        last_bar = prices.index[-1]
+
+        #predicting only the symbols without a fresh cached prediction
+        predictions, models, versions = {}, {}, {}
+        for symbol in symbols:
+            #keying the cache on the window length too, since traders with
+            #another n make other predictions from the same model files
+            versions[symbol] = (self.n, registry.version(symbol))
+            price = cache.get(symbol, versions[symbol], last_bar)
+            if price is None:
+                models[symbol] = registry.get(symbol, self.n)
+            else:
+                predictions[symbol] = price
+        if models:
+            new_predictions = self._predict_window(prices, models)
+            for symbol, price in new_predictions.items():
+                cache.put(symbol, versions[symbol], last_bar, price)
+            predictions.update(new_predictions)
+        return predictions
 
 
     def testLearner(self, symbol = "IBM", sd = "2009-01-01", ed = "2010-01-01"):
         """
             method for using the trained ML regressor to create a dataframe of
             stock trades for the given time period and stock to be fed into the
-            market simulator
+            market simulator; in intraday mode it trades once per bar
 
             inputs:
                 symbol:    string representing the stock symbol to trade
-                sd:        string representing the date to start trading
-                ed:        string representing the date to stop trading
+                sd:        string representing the date (or time) to start
+                           trading
+                ed:        string representing the date (or time) to stop
+                           trading
 
             output:
                 df_trades: pandas dataframe containing a trade (int) for each
-                           trading day between sd and ed
+                           trading day (or bar) between sd and ed
         """
-        #reading in the price data and normalizing it
+        #reading in the price data
         prices = self.preprocess_data(symbol, sd, ed)
+        return self.test_prices(prices)
+
+
+    @timed()
+    def predict_prices(self, prices):
+        """
+            method for predicting the normalized price of each trading day from
+            an already preprocessed dataframe of prices
+
+            input:
+                prices:      dataframe containing the daily prices of a stock
+
+            output:
+                prices_norm: dataframe containing the normalized prices without
+                             the first n days (blank indicators)
+                prices_pred: dataframe containing the predicted normalized
+                             prices for the same days
+        """
+        prices_norm, features = self.test_features(prices)
+
+        #predicting prices using Random Forest regressor
+        with span("MLTrader.learner_predict"):
+            prices_array = self.learner.predict(features)
+        prices_pred = pd.DataFrame(prices_array.reshape(-1, 1), columns=prices.columns,
+                                   index=prices_norm.index.values)
+        return prices_norm, prices_pred
+
+
+    def test_features(self, prices):
+        """
+            method for normalizing a dataframe of prices with the fitted
+            StandardScaler and indicator statistics and returning the features
+            to predict from
+
+            input:
+                prices:      dataframe containing the daily prices of a stock
+
+            output:
+                prices_norm: dataframe containing the normalized prices without
+                             the first n days (blank indicators)
+                features:    2D array containing the indicators and previous
+                             price of the same days
+        """
+        #normalizing the prices
+        symbol = prices.columns[0]
         prices_norm = pd.DataFrame(self.ss.transform(prices),index=prices.index,
                                    columns=[symbol])
 
-        #generating indicator dataframe for predicting
-        features_df = self.generate_indicators(prices_norm)
+        #generating indicator dataframe for predicting with the training
+        #normalization statistics
+        features_df = self.generate_indicators(prices_norm, self.indicator_stats)
 
         #removing the n days of blanks from prices and features_df
-        prices_norm = prices_norm.iloc[self.n:,:]
-        features_df = features_df.iloc[self.n:,:]
+        return prices_norm.iloc[self.n:,:], features_df.values[self.n:,:]
 
-        #predicting prices using Random Forest regressor
-        prices_array = self.learner.predict(features_df.values)
-        self.prices_pred = pd.DataFrame(prices_array,  columns=[symbol],
-                                        index=prices_norm.index.values)
 
-        #initializing df_trades to all 0s
-        trades_df = pd.DataFrame(np.zeros((prices_array.shape[0], 1)),
+    @timed()
+    def test_prices(self, prices):
+        """
+            method for creating the trades dataframe (see testLearner) from an
+            already preprocessed dataframe of prices
+
+            input:
+                prices:    dataframe containing the daily prices of a stock
+
+            output:
+                df_trades: pandas dataframe containing a trade (int) for each
+                           trading day
+        """
+        prices_norm, self.prices_pred = self.predict_prices(prices)
+
+        #buying/selling/holding on each trading day based on the next day's
+        #predicted stock price (holdings cannot exceed +/- 1000); starting at
+        #trading day n because we cannot trade using backfilled data
+        trades, n_trades, n_bad = trade_signals(self.prices_pred.values[:,0],
+                                                prices_norm.values[:,0],
+                                                self.impact, start=self.n)
+        #storing the total trades and bad trades for later comparison
+        self.trades, self.bad_trades = int(n_trades), int(n_bad)
+        trades_df = pd.DataFrame(trades.reshape(-1, 1),
                                  index=self.prices_pred.index,
                                  columns = ['Trade'])
         trades_df.index.rename('Date', inplace=True)
+        return trades_df
 
-        #looping through the trading days and buying/selling/holding based on
-        #the next day's predicted stock price; keeping counter variable for
-        #current holdings (current_holdings cannot exceed +/- 1000)
-        current_holdings = 0
-        #resetting total trades and bad trades counter variables
-        self.trades = 0
-        self.bad_trades = 0
-        #starting at trading day n because we cannot trade using backfilled data
-        for i in range(self.n,trades_df.shape[0]-1):
-            #buying/selling if price goes up/down, else holding
-            if self.prices_pred.iloc[i+1,0] > prices_norm.iloc[i,0]*(1+self.impact):  #price goes up
-                trades_df.iloc[i,0] = 1000 - current_holdings #buy as much as we can
-                current_holdings = 1000 #setting to current holdings
-                #counting the total number of trades for later comparison
-                self.trades+=1
-                #counting the number of times the learner shouldn't have traded
-                if prices_norm.iloc[i+1,0] < prices_norm.iloc[i,0]:
-                    self.bad_trades+=1
-            elif self.prices_pred.iloc[i+1,0] < prices_norm.iloc[i,0]*(1-self.impact):  #price goes down
-                trades_df.iloc[i,0] = -1000 - current_holdings #sell as much as we can
-                current_holdings = -1000  #setting to current
-                #counting the total number of trades for later comparison
-                self.trades+=1
-                #counting the number of times the learner shouldn't have traded
-                if prices_norm.iloc[i+1,0] > prices_norm.iloc[i,0]:
-                    self.bad_trades+=1
+
+    def fit_portfolio(self, symbols, sd, ed, alpha = 1.0, pooled = False):
+        """
+            method for training the ridge models of a universe of stocks in one
+            batched solve (see fit_many) and keeping them as the portfolio
+        """
+        traders = self.fit_many(symbols, sd, ed, alpha, pooled)
+        self.portfolio = {symbol: (trader.learner, trader.ss, trader.indicator_stats)
+                          for symbol, trader in traders.items()}
+
+
+    def load_portfolio(self, symbols, registry = None):
+        """
+            method for loading the saved models of a universe of stocks from a
+            ModelRegistry (defaults to the shared registry) as the portfolio
+        """
+        registry = default_registry() if registry is None else registry
+        self.portfolio = {symbol: registry.get(symbol, self.n) for symbol in symbols}
+
+
+    @timed()
+    def predict_portfolio(self, prices):
+        """
+            method for predicting the normalized prices of every stock in the
+            portfolio at once; the prices are normalized with one broadcast,
+            the features come from one pass of the indicator kernel, and the
+            linear models predict with one batched matrix product (other
+            learners predict one stock at a time)
+
+            input:
+                prices:      dataframe containing the daily prices of the
+                             portfolio's stocks (one column per stock)
+
+            output:
+                prices_norm: dataframe containing the normalized prices without
+                             the first n days (blank indicators)
+                prices_pred: dataframe containing the predicted normalized
+                             prices for the same days
+        """
+        symbols = list(prices.columns)
+        models = [self.portfolio[symbol] for symbol in symbols]
+
+        #normalizing every stock with its own StandardScaler parameters
+        mean, scale = _scaler_arrays(models)
+        prices_norm = (prices.astype(float) - mean) / scale
+
+        #generating the (stocks x days x features) tensor with the saved
+        #normalization statistics of each stock
+        features = self.generate_indicators_many(prices_norm, _saved_stats(models))
+        X = np.stack([features[symbol].values[self.n:] for symbol in symbols])
+
+        with span("MLTrader.learner_predict"):
+            pred = np.empty(X.shape[:2])
+            linear = np.array([is_linear(learner) for learner, _, _ in models], dtype=bool)
+            if linear.any():
+                coef = np.stack([np.ravel(models[i][0].coef_) for i in np.flatnonzero(linear)])
+                intercept = np.array([np.ravel(models[i][0].intercept_)[0]
+                                      for i in np.flatnonzero(linear)])
+                pred[linear] = np.einsum('stf,sf->st', X[linear], coef) + intercept[:, None]
+            for i in np.flatnonzero(~linear):
+                pred[i] = np.ravel(models[i][0].predict(X[i]))
+
+        prices_norm = prices_norm.iloc[self.n:]
+        prices_pred = pd.DataFrame(pred.T, index=prices_norm.index, columns=symbols)
+        return prices_norm, prices_pred
+
+
+    def start_streaming(self, prices):
+        """
+            method for warming up bar-by-bar predictions of the portfolio's
+            stocks (see predict_next) on their recent prices; each stock's
+            prices are normalized with its own StandardScaler before they're
+            fed to indicators.StreamingIndicators, so the streamed features
+            are the ones the models were trained on
+
+            input:
+                prices: dataframe containing at least the last n+1 prices of
+                        the portfolio's stocks (one column per stock)
+        """
+        symbols = list(prices.columns)
+        models = [self.portfolio[symbol] for symbol in symbols]
+        mean, scale = _scaler_arrays(models)
+        prices_norm = (prices.astype(float) - mean) / scale
+        stats = _fill_stats(raw_indicators(prices_norm, self.n), _saved_stats(models))
+        self._stream = (symbols, models, mean, scale,
+                        StreamingIndicators.from_history(prices_norm, self.n, stats))
+
+
+    def predict_next(self, prices):
+        """
+            method for adding the next bar of prices of the stocks given to
+            start_streaming and predicting each stock's price for that bar
+            (the same prediction as predict_portfolio makes for it) in O(1)
+            per stock
+
+            input:
+                prices:      array containing the next price of each stock in
+                             the order of the columns given to start_streaming
+
+            output:
+                predictions: dictionary mapping each stock symbol to its
+                             predicted price (NaN until n bars have streamed)
+        """
+        symbols, models, mean, scale, stream = self._stream
+        features = stream.update((np.asarray(prices, dtype=float) - mean) / scale)
+        pred = np.full(len(symbols), np.nan)
+        with span("MLTrader.learner_predict"):
+            for i, (learner, _, _) in enumerate(models):
+                if np.isfinite(features[i]).all():
+                    pred[i] = np.ravel(learner.predict(features[i:i+1]))[0]
+        return dict(zip(symbols, pred*scale + mean))
+
+
+    def test_portfolio(self, sd = "2009-01-01", ed = "2010-01-01", capital = 100000,
+                       max_position = 0.25, max_shares = None):
+        """
+            method for creating the (dates x stocks) trades of the portfolio
+            for the given time period (see test_portfolio_prices)
+        """
+        prices = self.preprocess_data(list(self.portfolio), sd, ed)
+        return self.test_portfolio_prices(prices, capital, max_position, max_shares)
+
+
+    @timed()
+    def test_portfolio_prices(self, prices, capital = 100000, max_position = 0.25,
+                              max_shares = None):
+        """
+            method for trading every stock of the portfolio at once: each stock
+            is long or short (or flat) following the same signals as
+            test_prices, the capital is split equally between the open
+            positions (at most max_position of it per stock), every position
+            is resized on the days any position opens, closes, or flips, and
+            in between a position is trimmed whenever it outgrows its share of
+            the capital at the day's prices, so the gross exposure never
+            exceeds the capital
+
+            inputs:
+                prices:       dataframe containing the daily prices of the
+                              portfolio's stocks (one column per stock)
+                capital:      float representing the money to allocate
+                max_position: float representing the largest fraction of the
+                              capital held in one stock
+                max_shares:   integer representing the largest long/short
+                              position in shares of one stock (None for no
+                              limit)
+
+            output:
+                trades_df:    dataframe containing the number of shares of
+                              each stock traded on each trading day (the wide
+                              trades format of marketsim.compute_portvals)
+        """
+        prices_norm, self.prices_pred = self.predict_portfolio(prices)
+
+        #getting each stock's direction (+1 long, -1 short, 0 flat) after each
+        #trading day from the single-stock signals
+        signals, n_trades, n_bad = trade_signals(self.prices_pred.values, prices_norm.values,
+                                                 self.impact, start=self.n, max_holdings=1)
+        self.trades, self.bad_trades = int(n_trades.sum()), int(n_bad.sum())
+        direction = np.cumsum(signals, axis=0)
+
+        #splitting the capital equally between the open positions (capped per
+        #stock) and converting the weights into whole shares
+        price_values = prices.values[self.n:].astype(float)
+        n_open = np.maximum((direction != 0).sum(axis=1, keepdims=True), 1)
+        weights = np.minimum(1 / n_open, max_position)
+        target = np.floor(weights * capital / price_values) * direction
+        if max_shares is not None:
+            target = np.clip(target, -max_shares, max_shares)
+
+        #holding the target shares of the last day any direction changed and
+        #trimming a position down to the day's target when its price has grown
+        #past its share of the capital, i.e. a running minimum of the target
+        #sizes that restarts on each change (offsetting each stretch below the
+        #previous ones restarts the minimum in one accumulate)
+        changed = np.ones(direction.shape[0], dtype=bool)
+        changed[1:] = (direction[1:] != direction[:-1]).any(axis=1)
+        size = np.abs(target)
+        offset = (size.max(initial=0) + 1) * np.cumsum(changed)[:, None]
+        holdings = direction * (np.minimum.accumulate(size - offset, axis=0) + offset)
+        trades = np.diff(holdings, axis=0, prepend=0)
+
+        trades_df = pd.DataFrame(trades, index=prices_norm.index, columns=prices.columns)
+        trades_df.index.rename('Date', inplace=True)
         return trades_df
+
+
+def _scaler_arrays(models):
+    #StandardScaler means and scales of (learner, ss, stats) triples
+    mean = np.array([np.ravel(ss.mean_)[0] for _, ss, _ in models])
+    scale = np.array([np.ravel(ss.scale_)[0] for _, ss, _ in models])
+    return mean, scale
+
+
+def _saved_stats(models):
+    #indicator statistics saved with (learner, ss, stats) triples (None if no
+    #model has them)
+    saved_stats = [stats for _, _, stats in models if stats is not None]
+    return pd.concat(saved_stats) if saved_stats else None
+
+
+def _fill_stats(indicators, stats):
+    #normalization statistics of every column of the raw indicators, using the
+    #given (saved) statistics where there are any and the indicators' own
+    #statistics for the rest
+    if stats is None or not indicators.columns.isin(stats.index).all():
+        window_stats = indicator_stats(indicators)
+        stats = window_stats if stats is None else pd.concat([window_stats, stats])
+        stats = stats[~stats.index.duplicated(keep='last')]
+    return stats
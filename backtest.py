@@ -0,0 +1,176 @@
+"""
+    walk-forward backtesting of MLTrader configurations: each configuration is
+    trained on a rolling train window and traded on the test window right
+    after it, for every symbol and window, in a pool of worker processes that
+    share one load of the price data
+"""
+import pandas as pd
+import numpy as np
+import itertools
+from multiprocessing import Pool
+from MLTrader import MLTrader
+from signals import trade_signals
+from dateutil.relativedelta import relativedelta
+
+
+def walk_forward_windows(sd, ed, train_months = 24, test_months = 6, step_months = None):
+    """
+        function for generating rolling train/test windows
+
+        inputs:
+            sd:           string/datetime representing the first date of data
+            ed:           string/datetime representing the last date of data
+            train_months: integer representing the length of the train window
+            test_months:  integer representing the length of the test window
+            step_months:  integer representing how far each window moves
+                          forward (defaults to test_months)
+
+        output:
+            windows:      list of (train_sd, train_ed, test_sd, test_ed)
+                          timestamp tuples (each end date is exclusive)
+    """
+    step_months = test_months if step_months is None else step_months
+    sd, ed = pd.Timestamp(sd), pd.Timestamp(ed)
+    windows = []
+    train_sd = sd
+    while True:
+        train_ed = train_sd + relativedelta(months=train_months)
+        test_ed = train_ed + relativedelta(months=test_months)
+        if test_ed > ed:
+            break
+        windows.append((train_sd, train_ed, train_ed, test_ed))
+        train_sd = train_sd + relativedelta(months=step_months)
+    return windows
+
+
+def pnl(trades, prices, impact = 0.0):
+    """
+        function for calculating the profit and loss of a series of trades,
+        charging the impact as a fraction of the traded value
+
+        inputs:
+            trades: array containing the number of shares traded each day
+            prices: array containing the (unnormalized) price of each day
+            impact: float representing the assumed impact of a trade
+
+        output:
+            pnl:    float representing the profit (or loss) of the trades
+    """
+    holdings = np.cumsum(trades)
+    gains = (holdings[:-1] * np.diff(prices)).sum()
+    costs = (impact * np.abs(trades) * prices).sum()
+    return gains - costs
+
+
+#price data shared by the tasks of each worker process
+_prices = None
+
+def _init_worker(prices):
+    global _prices
+    _prices = prices
+
+
+def _run_task(task):
+    """
+        helper function for running every learner kwargs/impact configuration
+        of one (symbol, n, window) task; the scaler, indicator statistics, and
+        features only depend on the window's prices, so they're computed once
+        and every learner is trained on them
+    """
+    symbol, n, window, learner, kwargs_list, impacts = task
+    train_sd, train_ed, test_sd, test_ed = window
+    prices = _prices[[symbol]]
+    train = prices.loc[(prices.index >= train_sd) & (prices.index < train_ed)]
+    test = prices.loc[(prices.index >= test_sd) & (prices.index < test_ed)]
+
+    def failed(kwargs, e):
+        #recording the error for each impact so the configuration still shows
+        #up in the summary
+        return [{'symbol': symbol, 'n': n, 'impact': impact, 'kwargs': kwargs,
+                 'test_sd': test_sd, 'trades': 0, 'bad_trades': 0, 'pnl': np.nan,
+                 'error': "{}: {}".format(type(e).__name__, e)}
+                for impact in impacts]
+
+    trader = MLTrader(None, n=n)
+    try:
+        features, targets = trader.train_features(train)
+        prices_norm, test_features = trader.test_features(test)
+    except ValueError as e:
+        #e.g. a symbol without prices in the window
+        return [row for kwargs in kwargs_list for row in failed(kwargs, e)]
+    actual = test[symbol].values[n:]
+
+    results = []
+    for kwargs in kwargs_list:
+        try:
+            model = learner(**kwargs)
+            model.fit(features, targets)
+            prices_pred = np.ravel(model.predict(test_features))
+        except (TypeError, ValueError) as e:
+            #e.g. kwargs the learner doesn't accept
+            results.extend(failed(kwargs, e))
+            continue
+        for impact in impacts:
+            trades, n_trades, n_bad = trade_signals(prices_pred, prices_norm.values[:,0],
+                                                    impact, start=n)
+            results.append({'symbol': symbol, 'n': n, 'impact': impact,
+                            'kwargs': kwargs, 'test_sd': test_sd,
+                            'trades': int(n_trades), 'bad_trades': int(n_bad),
+                            'pnl': pnl(trades, actual, impact), 'error': None})
+    return results
+
+
+def walk_forward(symbols, learner, param_grid, sd, ed, train_months = 24,
+                 test_months = 6, step_months = None, processes = None, trader = None):
+    """
+        function for backtesting a grid of MLTrader configurations over rolling
+        train/test windows
+
+        inputs:
+            symbols:      list of strings representing the stock symbols
+            learner:      ML class to train (see MLTrader)
+            param_grid:   dictionary with lists of values for "n", "impact", and
+                          "kwargs" (dictionaries of learner arguments)
+            sd:           string/datetime representing the first date of data
+            ed:           string/datetime representing the last date of data
+            train_months: integer representing the length of the train window
+            test_months:  integer representing the length of the test window
+            step_months:  integer representing how far each window moves
+            processes:    integer representing the number of worker processes
+                          (defaults to the number of CPUs)
+            trader:       MLTrader used to read the prices (defaults to one
+                          using the shared price store)
+
+        output:
+            summary:      dataframe with one row per configuration containing the
+                          total trades, bad trades, bad trade ratio, and P&L
+                          over every symbol and window, and the number of
+                          runs that succeeded and failed
+            results:      dataframe with one row per configuration, symbol, and
+                          test window (with the error of the runs that failed)
+    """
+    ns = param_grid.get('n', [9])
+    impacts = param_grid.get('impact', [0.0])
+    kwargs_list = param_grid.get('kwargs', [{}])
+    windows = walk_forward_windows(sd, ed, train_months, test_months, step_months)
+
+    #reading in the price data of every symbol once
+    trader = MLTrader(None) if trader is None else trader
+    prices = trader.preprocess_data(list(symbols), sd, ed)
+
+    tasks = [(symbol, n, window, learner, kwargs_list, impacts)
+             for symbol, n, window in itertools.product(symbols, ns, windows)]
+    with Pool(processes, initializer=_init_worker, initargs=(prices,)) as pool:
+        results = pd.DataFrame([row for rows in pool.imap_unordered(_run_task, tasks)
+                                for row in rows])
+    if results.empty:
+        return results, results
+
+    #aggregating the windows and symbols of each configuration
+    results['kwargs'] = results['kwargs'].apply(str)
+    grouped = results.assign(errors=results['error'].notna()).groupby(['n', 'impact', 'kwargs'])
+    summary = grouped[['trades', 'bad_trades', 'pnl', 'errors']].sum()
+    summary['bad_trade_ratio'] = summary['bad_trades'] / summary['trades'].replace(0, np.nan)
+    summary['runs'] = grouped.size() - summary['errors']
+    summary = summary[['trades', 'bad_trades', 'bad_trade_ratio', 'pnl', 'runs', 'errors']]
+    return summary.reset_index(), results
@@ -0,0 +1,384 @@
+"""
+    offline benchmark suite for the fetch layer and the indicators, backtest,
+    and prediction paths; prices are synthetic geometric brownian motion panels
+    served to a temporary price store (and by a local HTTP stand-in of the
+    price service), so nothing is downloaded
+
+    usage:
+        python benchmarks.py [--symbols 50] [--years 5] [--repeat 5]
+                             [--save baseline.json] [--compare baseline.json]
+                             [--tolerance 0.25]
+        python benchmarks.py --imports
+
+    --compare exits with status 1 if any benchmark got slower than the saved
+    baseline by more than the tolerance (a fraction of the baseline time), and
+    refuses a baseline saved with other --symbols/--years
+
+    --imports instead times importing each entry point in a fresh interpreter
+    and exits with status 1 if one fails to import (other than for a missing
+    optional dependency), is over its budget in IMPORT_BUDGETS, or imports a
+    heavy module it should only load lazily
+"""
+import pandas as pd
+import numpy as np
+import datetime as dt
+import argparse
+import threading
+import urllib.parse
+import tempfile
+import tracemalloc
+import shutil
+import subprocess
+import json
+import re
+import time
+import sys
+import os
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dateutil.relativedelta import relativedelta
+
+
+def gbm_prices(n_symbols, years, seed = 0, mu = 0.05, sigma = 0.3, end_date = None):
+    """
+        function for generating a panel of daily prices following geometric
+        brownian motion
+
+        inputs:
+            n_symbols: integer representing the number of stocks (a "SPY"
+                       column is always added for the trading days)
+            years:     float representing the years of business days to generate
+            seed:      integer seed of the random generator
+            mu:        float representing the yearly drift
+            sigma:     float representing the yearly volatility
+            end_date:  datetime of the day after the last price (defaults to
+                       today)
+
+        output:
+            prices:    dataframe indexed by date with one column per stock
+    """
+    end_date = dt.datetime.today() if end_date is None else end_date
+    dates = pd.bdate_range(end_date - relativedelta(days=int(365*years)),
+                           end_date - relativedelta(days=1))
+    symbols = ["S{:04d}".format(i) for i in range(n_symbols)] + ["SPY"]
+    rng = np.random.default_rng(seed)
+    dt_year = 1 / 252
+    log_returns = rng.normal((mu - sigma**2/2) * dt_year, sigma * np.sqrt(dt_year),
+                             size=(len(dates), len(symbols)))
+    start_prices = rng.uniform(10, 500, size=len(symbols))
+    return pd.DataFrame(start_prices * np.exp(np.cumsum(log_returns, axis=0)),
+                        index=dates, columns=symbols)
+
+
+class PanelFetcher:
+    """
+        price store fetcher serving closing prices from an in-memory panel
+        (a local stand-in for yfinance)
+    """
+
+    def __init__(self, prices):
+        self.prices = prices
+
+
+    def __call__(self, symbols, sd, ed):
+        mask = (self.prices.index >= sd) & (self.prices.index < ed)
+        return self.prices.loc[mask, [s for s in symbols if s in self.prices.columns]]
+
+
+def serve_panel(prices, host = "127.0.0.1", port = 0):
+    """
+        function for serving a panel of prices over HTTP in a background thread
+        with the protocol of util.HTTPBackend (a local stand-in of the price
+        service)
+
+        output:
+            server: the running ThreadingHTTPServer (call shutdown() to stop it)
+            url:    string representing the base url to give HTTPBackend
+    """
+    fetcher = PanelFetcher(prices)
+
+    class Handler(BaseHTTPRequestHandler):
+        #keeping connections alive between requests
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            if url.path != "/prices":
+                self.send_error(404)
+                return
+            closes = fetcher(query['symbols'][0].split(","), pd.Timestamp(query['start'][0]),
+                             pd.Timestamp(query['end'][0]))
+            body = closes.rename_axis("Date").to_csv().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://{}:{}".format(*server.server_address)
+
+
+def measure(func, repeat):
+    """
+        function for timing a function (best of repeat runs) and measuring its
+        peak traced memory in one extra run
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / 2**20
+
+
+#import time budget in seconds (best of the runs, not counting interpreter
+#startup) and the heavy modules each entry point must not import eagerly; the
+#dash app is imported in fast-start mode
+IMPORT_BUDGETS = {
+    "MLTrader": (1.0, ["sklearn", "joblib", "matplotlib", "yfinance"]),
+    "util": (1.0, ["matplotlib", "sklearn", "yfinance"]),
+    "model_registry": (1.0, ["joblib", "sklearn"]),
+    "serving": (1.0, ["matplotlib", "sklearn", "joblib"]),
+    "train_models": (1.0, ["sklearn", "matplotlib", "yfinance"]),
+    "dash_app": (3.0, ["sklearn", "matplotlib", "yfinance", "plotly.express"]),
+}
+
+
+def measure_import(module, repeat = 3):
+    """
+        function for timing the import of a module in fresh interpreters
+
+        output:
+            seconds: float representing the fastest import (None if the import
+                     failed)
+            modules: list of the modules loaded by the import
+            error:   string containing the last line of the traceback of a
+                     failed import (None if it succeeded)
+    """
+    code = ("import time, sys, json; start = time.perf_counter(); import {}; "
+            "print(json.dumps([time.perf_counter() - start, sorted(sys.modules)]))").format(module)
+    env = dict(os.environ, STOCK_APP_FAST_START="1")
+    seconds, modules = None, []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+        if result.returncode != 0:
+            lines = result.stderr.strip().splitlines()
+            return None, [], lines[-1] if lines else "exit status {}".format(result.returncode)
+        run_seconds, modules = json.loads(result.stdout.strip().splitlines()[-1])
+        seconds = run_seconds if seconds is None else min(seconds, run_seconds)
+    return seconds, modules, None
+
+
+def missing_dependency(error):
+    """
+        function returning the name of the third-party module a failed import
+        was missing (e.g. dash when only the trainer's requirements are
+        installed) or None if the import failed for any other reason
+    """
+    missing = re.match(r"ModuleNotFoundError: No module named '([^'.]+)", error or "")
+    if missing is None:
+        return None
+    #a missing module of this repo is a real failure, not an optional dependency
+    here = os.path.dirname(os.path.abspath(__file__))
+    if os.path.isfile(os.path.join(here, missing.group(1) + ".py")):
+        return None
+    return missing.group(1)
+
+
+def check_imports(budgets = None, repeat = 3):
+    """
+        function for checking the import time budget of each entry point;
+        entry points missing an optional dependency are skipped, any other
+        import error is a violation
+
+        output:
+            results:    dictionary mapping each module to its seconds, budget,
+                        the heavy modules it imported, and the dependency it
+                        was skipped for (if any)
+            violations: list of strings describing the broken budgets
+    """
+    budgets = IMPORT_BUDGETS if budgets is None else budgets
+    results, violations = {}, []
+    for module, (budget, heavy) in budgets.items():
+        seconds, modules, error = measure_import(module, repeat)
+        loaded = [name for name in heavy if name in modules]
+        skipped = missing_dependency(error)
+        if skipped == module.split('.')[0]:
+            #the entry point itself is missing
+            skipped = None
+        results[module] = {'seconds': seconds, 'budget': budget, 'heavy': loaded,
+                           'skipped': skipped}
+        if error is not None:
+            if results[module]['skipped'] is None:
+                violations.append("{} failed to import: {}".format(module, error))
+            continue
+        if seconds > budget:
+            violations.append("{} took {:.3f}s (budget {:.3f}s)".format(module, seconds, budget))
+        if loaded:
+            violations.append("{} imported {}".format(module, ", ".join(loaded)))
+    return results, violations
+
+
+def run_benchmarks(n_symbols = 50, years = 5, repeat = 5):
+    """
+        function for running every benchmark on a synthetic panel
+
+        inputs:
+            n_symbols: integer representing the number of stocks in the panel
+            years:     float representing the years of prices in the panel
+            repeat:    integer representing the timed runs per benchmark
+
+        output:
+            results:   dictionary mapping each benchmark name to its seconds
+                       (best run), rows per second, and peak memory in MB
+    """
+    from price_store import PriceStore, set_default_store
+    from util import BulkFetcher, HTTPBackend
+    from MLTrader import MLTrader
+    from indicators import price_sma_ratio, bollinger_bands, volatility, compute_indicators
+    from sklearn.linear_model import Ridge
+
+    prices = gbm_prices(n_symbols, years)
+    panel = prices.drop(columns="SPY")
+    symbol = panel.columns[0]
+    sd, ed = prices.index[0], prices.index[-1] + relativedelta(days=1)
+    split = prices.index[len(prices) * 4 // 5]
+
+    #serving the panel from a local HTTP stand-in into a temporary price store
+    root = tempfile.mkdtemp(prefix="price_data_")
+    server, url = serve_panel(prices)
+    try:
+        fetcher = BulkFetcher(HTTPBackend(url), batch_size=25, rate=None)
+        store = PriceStore(root=root, fetcher=fetcher)
+        store.refresh(list(prices.columns), sd, ed)
+        set_default_store(store)
+
+        trader = MLTrader(Ridge, n=10, kwargs={'alpha': 0.001})
+        trader.fit(symbol, sd, split)
+        trades_df = trader.testLearner(symbol, split, ed)
+        one = trader.preprocess_data(symbol, sd, ed)
+        one_norm = pd.DataFrame(trader.ss.transform(one), index=one.index, columns=[symbol])
+
+        #(name, function, rows processed per call)
+        benchmarks = [
+            ("BulkFetcher", lambda: fetcher(list(prices.columns), sd, ed), prices.size),
+            ("price_sma_ratio", lambda: price_sma_ratio(panel, 10), panel.size),
+            ("bollinger_bands", lambda: bollinger_bands(panel, 10), panel.size),
+            ("volatility", lambda: volatility(panel, 10), panel.size),
+            ("compute_indicators", lambda: compute_indicators(panel, 10), panel.size),
+            ("MLTrader.generate_indicators", lambda: trader.generate_indicators(one_norm), len(one)),
+            ("MLTrader.fit", lambda: MLTrader(Ridge, n=10, kwargs={'alpha': 0.001})
+                                         .fit(symbol, sd, split), len(one)),
+            ("MLTrader.testLearner", lambda: trader.testLearner(symbol, split, ed), len(trades_df)),
+            ("MLTrader.predict_today", lambda: trader.predict_today(symbol), 1),
+            ("MLTrader.generate_orders_df", lambda: trader.generate_orders_df(trades_df, symbol),
+             len(trades_df)),
+        ]
+
+        results = {}
+        for name, func, rows in benchmarks:
+            seconds, peak_mb = measure(func, repeat)
+            results[name] = {'seconds': seconds, 'rows_per_second': rows / seconds,
+                             'peak_mb': peak_mb}
+    finally:
+        server.shutdown()
+        set_default_store(None)
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def load_baseline(path, n_symbols, years):
+    """
+        function for reading a baseline saved with --save, raising a
+        ValueError if it was measured on another panel size (its times
+        wouldn't be comparable)
+
+        output:
+            baseline: dictionary mapping each benchmark name to its result
+    """
+    with open(path) as f:
+        saved = json.load(f)
+    if saved.get('symbols') != n_symbols or saved.get('years') != years:
+        raise ValueError("the baseline {} was measured with --symbols {} --years {}, not "
+                         "--symbols {} --years {}".format(path, saved.get('symbols'),
+                                                          saved.get('years'), n_symbols, years))
+    return saved['results']
+
+
+def compare(results, baseline, tolerance = 0.25):
+    """
+        function for comparing benchmark results to a saved baseline
+
+        output:
+            slower: list of (name, baseline seconds, seconds) of the benchmarks
+                    that got slower by more than the tolerance
+    """
+    slower = []
+    for name, result in results.items():
+        if name in baseline and result['seconds'] > baseline[name]['seconds'] * (1 + tolerance):
+            slower.append((name, baseline[name]['seconds'], result['seconds']))
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run the offline benchmark suite")
+    parser.add_argument("--symbols", type=int, default=50, help="stocks in the synthetic panel")
+    parser.add_argument("--years", type=float, default=5, help="years of synthetic prices")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--save", help="json file to save the results to as a baseline")
+    parser.add_argument("--compare", help="baseline json file to compare the results to")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown as a fraction of the baseline time")
+    parser.add_argument("--imports", action="store_true",
+                        help="check the import time budgets instead")
+    args = parser.parse_args()
+
+    if args.imports:
+        results, violations = check_imports(repeat=args.repeat)
+        print("{:<20} {:>10} {:>10}".format("module", "seconds", "budget"))
+        for module, result in results.items():
+            if result['skipped'] is not None:
+                seconds = "skipped (no {})".format(result['skipped'])
+            elif result['seconds'] is None:
+                seconds = "failed"
+            else:
+                seconds = "{:.3f}".format(result['seconds'])
+            print("{:<20} {:>10} {:>10.3f}".format(module, seconds, result['budget']))
+        for violation in violations:
+            print("OVER BUDGET: {}".format(violation))
+        sys.exit(1 if violations else 0)
+
+    if args.compare:
+        #checking the baseline before spending time on the benchmarks
+        try:
+            baseline = load_baseline(args.compare, args.symbols, args.years)
+        except ValueError as e:
+            parser.error(str(e))
+
+    results = run_benchmarks(args.symbols, args.years, args.repeat)
+    print("{:<30} {:>10} {:>14} {:>9}".format("benchmark", "seconds", "rows/second", "peak MB"))
+    for name, result in results.items():
+        print("{:<30} {:>10.5f} {:>14,.0f} {:>9.2f}".format(
+            name, result['seconds'], result['rows_per_second'], result['peak_mb']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'symbols': args.symbols, 'years': args.years, 'results': results},
+                      f, indent=2)
+
+    if args.compare:
+        slower = compare(results, baseline, args.tolerance)
+        for name, before, after in slower:
+            print("SLOWER: {} {:.5f}s -> {:.5f}s".format(name, before, after))
+        sys.exit(1 if slower else 0)
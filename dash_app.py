@@ -2,26 +2,94 @@ import dash
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
-import plotly.graph_objs as go
-import plotly.express as px
+from dash.exceptions import PreventUpdate
 
 import pandas as pd
 import datetime as dt
-import yfinance as yf
+import os
+import threading
+import concurrent.futures
 from MLTrader import MLTrader
-from util import pull_prices_viz
+from util import lttb
+from model_registry import default_registry
+from price_refresher import PriceRefresher, PricesUnavailable
+from serving import SharedSnapshotReader, CoalescingExecutor
+from flask import jsonify
+from instrumentation import timed, span, register_endpoints
 from dateutil.relativedelta import relativedelta
 
 app = dash.Dash(name=__name__)
+#WSGI entry point for gunicorn (see gunicorn.conf.py)
+server = app.server
 
 periods_list = ["5 Days", "1 Month", "3 Months", "6 Months",
                 "1 Year", "2 Years", "5 Years"]
+#maximum number of points sent to the graph for one series
+max_plot_points = 1000
 
 #reading in NYSE stock tickers
 tickers = pd.read_csv("yfinance_tickers.csv")
-tickers_str = ' '.join(tickers.Symbol.values)
-#initializing data and graph
-prices = pull_prices_viz(tickers_str, "5y")
+ticker_by_name = dict(zip(tickers.Name, tickers.Symbol))
+#loading every ticker's model once so the callbacks don't unpickle them; in
+#fast-start mode (STOCK_APP_FAST_START=1) the models are loaded in the
+#background so the server can take requests right away
+registry = default_registry()
+if os.environ.get("STOCK_APP_FAST_START") == "1":
+    threading.Thread(target=registry.preload, args=(tickers.Symbol.values,),
+                     daemon=True).start()
+else:
+    registry.preload(tickers.Symbol.values)
+
+def predict_ticker(ticker):
+    #predicting today's price of one ticker (the model comes from the registry)
+    return MLTrader(None, n=10).predict_many([ticker], registry)[ticker]
+
+def warm_predictions(snapshot):
+    #predicting today's prices for every ticker in one batched pass
+    MLTrader(None, n=10).predict_many(tickers.Symbol.values, registry)
+
+#running the blocking predictions off the request threads, so concurrent
+#requests for the same ticker share one computation
+predictions = CoalescingExecutor(max_workers=4)
+#seconds a callback waits for a prediction before showing it as unavailable
+prediction_timeout = 20
+
+if os.environ.get("STOCK_APP_SNAPSHOT"):
+    #serving under gunicorn: the prices are read from the snapshot the
+    #publisher process keeps in shared memory
+    refresher = SharedSnapshotReader(os.environ["STOCK_APP_SNAPSHOT"])
+else:
+    #initializing data lazily: the first callback serves the cached prices and
+    #starts refreshing them (and the predictions) in the background every hour
+    refresher = PriceRefresher(tickers.Symbol.values, "5y", interval=3600,
+                               on_refresh=warm_predictions)
+
+#exposing the timing spans and counters on /metrics
+register_endpoints(app.server)
+
+@app.server.route("/price-status")
+def price_status():
+    return jsonify(refresher.status())
+
+def predicted_price(ticker):
+    #under gunicorn the publisher predicts every ticker with each snapshot,
+    #so the workers only predict the tickers it couldn't
+    if isinstance(refresher, SharedSnapshotReader):
+        price = refresher.predictions().get(ticker)
+        if price is not None:
+            return price
+    try:
+        return predictions.run(ticker, predict_ticker, ticker, timeout=prediction_timeout)
+    except concurrent.futures.TimeoutError:
+        return None
+
+def current_snapshot():
+    #leaving the page as it is while no prices could be loaded yet (the
+    #refresh error is shown on /price-status)
+    try:
+        return refresher.snapshot()
+    except PricesUnavailable:
+        raise PreventUpdate
 
 #setting layout and title
 app.title = "Stock Price Prediction App"
@@ -91,12 +159,10 @@ app.layout = html.Div(className='main-body', children=[
     [Input('company-name', 'value'),
      Input('timeframe', 'value')]
 )
+@timed("callback.create_plot")
 def create_plot(name, timeframe):
     #retrieving stock ticker
-    ticker = tickers[tickers.Name == name].Symbol.values[0]
-
-    #filtering prices by selected stock
-    prices_one = prices.filter(items=["Date",ticker],axis=1)
+    ticker = ticker_by_name[name]
 
     #splitting time input
     t_list = timeframe.split(' ')
@@ -111,22 +177,27 @@ def create_plot(name, timeframe):
     else:
         start_date = end_date - relativedelta(years=t_qty)
 
-    #filtering prices by start and end dates
-    mask = (prices_one['Date'] >= start_date) & (prices_one['Date'] <= end_date)
-    prices_one = prices_one.loc[mask]
-
-    #creating graph
-    title = "{} Price over the last {}".format(ticker.upper(), timeframe)
-    fig = px.line(prices_one, x="Date", y=ticker, title=title)
-
-    #updating graph layout (docs: https://plot.ly/python/reference/#layout)
-    fig["layout"].update(paper_bgcolor="#0a2863", plot_bgcolor="#0a2863",
-                         title={'xanchor':'center', 'y':0.9, 'x':0.5,
-                                'font':{'color':'white'}},
-                         xaxis={'showgrid': False, 'color':'white'},
-                         yaxis={'showgrid': False, 'color':'white',
-                                'title':'Stock Price'},
-                         height=400)
+    #viewing the selected stock's prices between the start and end dates
+    #(no copy of the panel) and downsampling long timeframes
+    window = current_snapshot().prices.between(start_date, end_date)
+    dates, values = lttb(window.dates, window[ticker], max_plot_points)
+    prices_one = pd.DataFrame({"Date": dates, ticker: values})
+
+    #creating graph (plotly express is imported on the first plot since it's
+    #slow to import)
+    import plotly.express as px
+    with span("callback.create_plot.figure"):
+        title = "{} Price over the last {}".format(ticker.upper(), timeframe)
+        fig = px.line(prices_one, x="Date", y=ticker, title=title)
+
+        #updating graph layout (docs: https://plot.ly/python/reference/#layout)
+        fig["layout"].update(paper_bgcolor="#0a2863", plot_bgcolor="#0a2863",
+                             title={'xanchor':'center', 'y':0.9, 'x':0.5,
+                                    'font':{'color':'white'}},
+                             xaxis={'showgrid': False, 'color':'white'},
+                             yaxis={'showgrid': False, 'color':'white',
+                                    'title':'Stock Price'},
+                             height=400)
     return fig
 
 
@@ -137,29 +208,31 @@ def create_plot(name, timeframe):
      Output('company-ticker', 'children')],
     [Input('company-name', 'value')]
 )
+@timed("callback.show_prices")
 def show_prices(name):
     #retrieving stock ticker
-    ticker = tickers[tickers.Name == name].Symbol.values[0]
-
-    #creating the trader and loading the given stock's model
-    trader = MLTrader(None, n=10)
-    trader.load_learner(ticker)
+    ticker = ticker_by_name[name]
 
-    #getting the current stock price and predicting tomorrow's price
-    current_price = round(prices[ticker].values[-1],2)
-    predicted_price = round(trader.predict_today(ticker),2)
+    #getting the current stock price and today's (cached) predicted price
+    current_price = round(float(current_snapshot().series[ticker][-1]),2)
+    predicted = predicted_price(ticker)
+    if predicted is None:
+        #the prediction is still running, so the next selection picks it up
+        return ("${:,.2f}".format(current_price), "Unavailable",
+                {'color':'white', 'textAlign':'center'}, ticker)
+    predicted = round(predicted,2)
 
     #deciding if the predicted price is higher or lower than the current price
-    if predicted_price > current_price:
+    if predicted > current_price:
         color = "green"
-    elif predicted_price < current_price:
+    elif predicted < current_price:
         color = "red"
     else:
         color = "white"
 
     #formatting strings to display
     current_str = "${:,.2f}".format(current_price)
-    predicted_str = "${:,.2f}".format(predicted_price)
+    predicted_str = "${:,.2f}".format(predicted)
     predicted_style = {'color':color, 'textAlign':'center'}
 
     return current_str,predicted_str,predicted_style,ticker
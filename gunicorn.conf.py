@@ -0,0 +1,36 @@
+"""
+    gunicorn settings for serving the dash app from several worker processes
+    that share one read-only price snapshot (see serving.py)
+
+    usage:
+        gunicorn -c gunicorn.conf.py dash_app:server
+"""
+import multiprocessing
+import tempfile
+import os
+
+bind = os.environ.get("STOCK_APP_BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("STOCK_APP_WORKERS", multiprocessing.cpu_count()))
+#threaded workers, so a request waiting on a prediction doesn't block the others
+worker_class = "gthread"
+threads = int(os.environ.get("STOCK_APP_THREADS", 4))
+
+#the workers inherit the manifest path and read the snapshot from it instead
+#of each pulling its own copy of the prices
+os.environ.setdefault("STOCK_APP_SNAPSHOT", os.path.join(
+    tempfile.gettempdir(), "stock_app_snapshot_{}.json".format(os.getpid())))
+
+
+def when_ready(server):
+    import pandas as pd
+    from serving import start_publisher
+
+    symbols = pd.read_csv("yfinance_tickers.csv").Symbol.values
+    server.publisher = start_publisher(os.environ["STOCK_APP_SNAPSHOT"], symbols)
+
+
+def on_exit(server):
+    publisher = getattr(server, "publisher", None)
+    if publisher is not None:
+        publisher.terminate()
+        publisher.join(10)
@@ -1,7 +1,9 @@
 #importing dependencies
 import pandas as pd
 import numpy as np
+from instrumentation import timed
 
+@timed()
 def price_sma_ratio(prices, n):
     """
         function to calculate the price/n-day SMA (Simple Moving
@@ -22,6 +24,7 @@ def price_sma_ratio(prices, n):
     return price_sma
 
 
+@timed()
 def bollinger_bands(prices, n):
     """
         function to calculate the Boelinger Bands of the given stocks
@@ -46,6 +49,7 @@ def bollinger_bands(prices, n):
     return bb
 
 
+@timed()
 def volatility(prices, n):
     """
         function to calculate the n-day std dev of the daily returns of the
@@ -66,3 +70,308 @@ def volatility(prices, n):
     vol = daily_ret.rolling(window=n, min_periods=n).std()
     vol = (vol - vol.mean()) / vol.std()  #normalizing the indicator
     return vol
+
+
+def _rolling_moments(values, n, block = 64):
+    """
+        helper function to calculate the n-day rolling mean and std dev of each
+        column of a 2D array from running sums; the sums restart every block
+        of days around that block's own average price, so they stay small and
+        the std dev doesn't lose precision as prices drift
+
+        inputs:
+            values:      2D float array with one column per stock
+            n:           integer representing the number of days in the window
+            block:       integer representing the number of windows computed
+                         from each set of running sums, which bounds the
+                         temporary memory to (block + n) days of every stock
+        output:
+            mean:        2D array of rolling means (NaN until n valid days)
+            std:         2D array of rolling std devs (NaN until n valid days)
+    """
+    values = np.asarray(values, dtype=float)
+    mean = np.full(values.shape, np.nan)
+    var = np.full(values.shape, np.nan)
+    for lo in range(n-1, values.shape[0], block):
+        hi = min(lo + block, values.shape[0])
+        #the windows ending on days lo..hi-1 span days lo-n+1..hi-1
+        segment = values[lo-n+1:hi]
+        missing = np.isnan(segment)
+        valid = (~missing).sum(axis=0)
+        center = np.where(missing, 0.0, segment).sum(axis=0) / np.maximum(valid, 1)
+        centered = np.where(missing, 0.0, segment - center)
+
+        #running sums with a leading row of zeros, so each window's sum is
+        #the difference of two rows n apart
+        sums = np.zeros((len(segment)+1, segment.shape[1]))
+        squares = np.zeros_like(sums)
+        gaps = np.zeros(sums.shape, dtype=int)
+        np.cumsum(centered, axis=0, out=sums[1:])
+        np.cumsum(centered*centered, axis=0, out=squares[1:])
+        np.cumsum(missing, axis=0, out=gaps[1:])
+
+        window_sum = sums[n:] - sums[:-n]
+        window_mean = window_sum / n
+        #a window with a missing price stays NaN
+        complete = (gaps[n:] - gaps[:-n]) == 0
+        mean[lo:hi] = np.where(complete, window_mean + center, np.nan)
+        if n > 1:
+            window_ss = squares[n:] - squares[:-n] - window_sum*window_mean
+            #the running sums carry rounding of about eps*len(segment) times
+            #the largest squared deviation, so a window whose spread is close
+            #to that is recomputed exactly (two passes over its own prices)
+            rounding = np.finfo(float).eps * len(segment) * (centered*centered).max(axis=0, initial=0)
+            rows, cols = np.nonzero(complete & (window_ss <= 1e10*rounding))
+            if len(rows):
+                windows = values[(lo + rows)[:, None] + np.arange(1-n, 1), cols[:, None]]
+                deviations = windows - windows.mean(axis=1, keepdims=True)
+                window_ss[rows, cols] = (deviations*deviations).sum(axis=1)
+            var[lo:hi] = np.where(complete, np.maximum(window_ss, 0.0) / (n - 1), np.nan)
+
+    #windows of identical prices have a std dev of exactly 0 (matching
+    #pandas) even if their mean rounds away from the price
+    if n > 1:
+        rows = np.arange(values.shape[0]).reshape(-1, 1)
+        changed = np.ones(values.shape, dtype=bool)
+        changed[1:] = values[1:] != values[:-1]
+        run_start = np.maximum.accumulate(np.where(changed, rows, 0), axis=0)
+        var[~np.isnan(var) & (rows - run_start + 1 >= n)] = 0.0
+    return mean, np.sqrt(var)
+
+
+#names of the indicators in the order they're used as features
+INDICATOR_NAMES = ["Price/SMA", "Bollinger Bands", "Volatility"]
+
+
+@timed()
+def raw_indicators(prices, n):
+    """
+        function to calculate the Price/SMA ratio, Bollinger Bands, and
+        volatility of every stock in a wide (dates x stocks) dataframe at once,
+        sharing the rolling moments of the prices between the indicators,
+        without normalizing them
+
+        inputs:
+            prices:      dataframe containing the prices of the
+                         given stocks
+            n:           integer representing the number of days to
+                         use for calculating momentum
+        output:
+            indicators:  dataframe with (indicator, stock) columns containing
+                         the "Price/SMA", "Bollinger Bands", and "Volatility"
+                         of each stock for each trading day
+    """
+    values = prices.values.astype(float)
+    sma, rolling_std = _rolling_moments(values, n)
+
+    #daily returns of each stock (0 on the first trading day)
+    daily_ret = np.zeros(values.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        daily_ret[1:] = values[1:] / values[:-1] - 1
+    _, vol = _rolling_moments(daily_ret, n)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        price_sma = values / sma
+        bb = (values - (sma - 2*rolling_std)) / (4*rolling_std)
+    bb[:n] = np.nan
+    bb[np.isinf(bb)] = np.nan
+
+    #keeping float32 prices (e.g. intraday bars) in float32 after computing
+    #the rolling sums in float64
+    dtype = np.float32 if (prices.dtypes == np.float32).all() else float
+    indicators = {}
+    for name, indicator in zip(INDICATOR_NAMES, [price_sma, bb, vol]):
+        indicators[name] = pd.DataFrame(indicator.astype(dtype, copy=False),
+                                        index=prices.index, columns=prices.columns)
+    return pd.concat(indicators, axis=1)
+
+
+def indicator_stats(indicators):
+    """
+        function to calculate the normalization statistics of raw indicators
+
+        inputs:
+            indicators:  dataframe of raw indicators (see raw_indicators)
+        output:
+            stats:       dataframe indexed by (indicator, stock) containing the
+                         mean and std of each indicator
+    """
+    return pd.concat({'mean': indicators.mean(), 'std': indicators.std()}, axis=1)
+
+
+def normalize_indicators(indicators, stats):
+    """
+        function to z-score raw indicators with the given statistics
+
+        inputs:
+            indicators:  dataframe of raw indicators (see raw_indicators)
+            stats:       dataframe of normalization statistics (see
+                         indicator_stats)
+        output:
+            indicators:  dataframe of normalized indicators
+    """
+    stats = stats.reindex(indicators.columns)
+    return (indicators - stats['mean']) / stats['std']
+
+
+@timed()
+def compute_indicators(prices, n):
+    """
+        function to calculate the normalized Price/SMA ratio, Bollinger Bands,
+        and volatility of every stock in a wide (dates x stocks) dataframe at
+        once; each stock's columns match price_sma_ratio, bollinger_bands, and
+        volatility run on that stock alone (bollinger bands are NaN for the
+        first n days and where the bands have no width)
+
+        inputs:
+            prices:      dataframe containing the prices of the
+                         given stocks
+            n:           integer representing the number of days to
+                         use for calculating momentum
+        output:
+            indicators:  dataframe with (indicator, stock) columns containing
+                         the normalized "Price/SMA", "Bollinger Bands", and
+                         "Volatility" of each stock for each trading day
+    """
+    indicators = raw_indicators(prices, n)
+    return normalize_indicators(indicators, indicator_stats(indicators))
+
+
+class StreamingIndicators:
+    """
+        class for updating the normalized indicators of many stocks one bar at
+        a time; it keeps the last n prices and daily returns of each stock
+        with their rolling sums, so each new bar costs O(1) per stock instead
+        of recomputing the windows over the whole history
+
+        the features match MLTrader's only if the prices are normalized the
+        way it normalizes them (each stock with its own fitted StandardScaler)
+        before they're passed to from_history/update, since the indicator
+        statistics and the previous price column are of normalized prices;
+        MLTrader.start_streaming and predict_next do this
+
+        inputs:
+            n:           integer representing the number of days to
+                         use for calculating momentum
+            stats:       dataframe of normalization statistics (see
+                         indicator_stats) used to z-score the indicators
+            symbols:     list of strings representing the stock symbols in
+                         the order of the prices passed to update
+    """
+
+    def __init__(self, n, stats, symbols):
+        self.n = n
+        self.symbols = list(symbols)
+        stats = stats.reindex(pd.MultiIndex.from_product([INDICATOR_NAMES, self.symbols]))
+        self.mean = stats['mean'].values.reshape(len(INDICATOR_NAMES), -1)
+        self.std = stats['std'].values.reshape(len(INDICATOR_NAMES), -1)
+
+        #ring buffers of the last n prices/returns and their rolling sums; the
+        #sums are taken around a per-stock shift near the window's mean so the
+        #sum of squares doesn't lose precision as prices drift
+        self._prices = np.full((n, len(self.symbols)), np.nan)
+        self._rets = np.full((n, len(self.symbols)), np.nan)
+        self._sums = np.zeros((4, len(self.symbols)))
+        self._shift = None
+        #number of bars in a row with an identical price/return
+        self._runs = np.zeros((2, len(self.symbols)))
+        self._last = None
+        self._last_ret = None
+        self._pos = 0
+        self.count = 0
+
+
+    @classmethod
+    def from_history(cls, prices, n, stats = None):
+        """
+            method for creating a StreamingIndicators object warmed up on the
+            last days of a dataframe of prices
+
+            inputs:
+                prices:  dataframe containing the prices of the given stocks
+                n:       integer representing the window length
+                stats:   normalization statistics (defaults to the statistics
+                         of the given prices)
+
+            output:
+                stream:  StreamingIndicators object whose next update is the
+                         day after the last day of prices
+        """
+        if stats is None:
+            stats = indicator_stats(raw_indicators(prices, n))
+        stream = cls(n, stats, prices.columns)
+        #the first return of the warm-up is 0 like in the batch indicators, so
+        #one extra day is fed to get n real returns
+        for row in prices.values[-(n+1):]:
+            stream.update(row)
+        return stream
+
+
+    def update(self, prices):
+        """
+            method for adding the next bar of prices and returning the new
+            normalized features of each stock
+
+            input:
+                prices:   array containing the next price of each stock
+
+            output:
+                features: array with one row per stock containing the
+                          normalized Price/SMA, Bollinger Bands, and Volatility
+                          and the previous price (NaN until enough bars)
+        """
+        prices = np.asarray(prices, dtype=float)
+        previous = np.full(prices.shape, np.nan) if self._last is None else self._last
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ret = np.zeros(prices.shape) if self._last is None else prices / previous - 1
+        if self._shift is None:
+            self._shift = np.stack([np.where(np.isnan(prices), 0.0, prices), np.zeros(prices.shape)])
+
+        #counting the runs of identical prices/returns, whose windows have a
+        #std dev of exactly 0 like in the batch indicators
+        for i, (value, last) in enumerate([(prices, self._last), (ret, self._last_ret)]):
+            same = np.zeros(prices.shape, dtype=bool) if last is None else value == last
+            self._runs[i] = np.where(same, self._runs[i] + 1, 1)
+
+        #swapping the oldest bar out of the rolling sums for the new one
+        p, r = prices - self._shift[0], ret - self._shift[1]
+        if self.count >= self.n:
+            old_p = self._prices[self._pos] - self._shift[0]
+            old_r = self._rets[self._pos] - self._shift[1]
+            self._sums -= np.stack([old_p, old_p*old_p, old_r, old_r*old_r])
+        self._sums += np.stack([p, p*p, r, r*r])
+        self._prices[self._pos], self._rets[self._pos] = prices, ret
+        self._pos = (self._pos + 1) % self.n
+        self._last, self._last_ret = prices, ret
+        self.count += 1
+
+        #resyncing the sums from the buffers once per window (around the
+        #window's mean as the new shift) so rounding errors don't build up
+        if self._pos == 0:
+            self._shift = np.stack([self._prices.mean(axis=0), self._rets.mean(axis=0)])
+            self._shift[np.isnan(self._shift)] = 0.0
+            p = self._prices - self._shift[0]
+            r = self._rets - self._shift[1]
+            self._sums = np.stack([p.sum(axis=0), (p*p).sum(axis=0),
+                                   r.sum(axis=0), (r*r).sum(axis=0)])
+
+        raw = np.full((len(INDICATOR_NAMES), prices.shape[0]), np.nan)
+        if self.count >= self.n:
+            n = self.n
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sma = self._sums[0] / n + self._shift[0]
+                rolling_std = np.sqrt(np.maximum(self._sums[1] - self._sums[0]**2 / n, 0) / (n-1))
+                vol = np.sqrt(np.maximum(self._sums[3] - self._sums[2]**2 / n, 0) / (n-1))
+                rolling_std[self._runs[0] >= n] = 0.0
+                vol[self._runs[1] >= n] = 0.0
+                raw[0] = prices / sma
+                if self.count > self.n:
+                    bb = (prices - (sma - 2*rolling_std)) / (4*rolling_std)
+                    raw[1] = np.where(np.isinf(bb), np.nan, bb)
+                raw[2] = vol
+
+        #normalizing the indicators with the saved statistics
+        features = np.empty((prices.shape[0], len(INDICATOR_NAMES) + 1))
+        features[:, :-1] = ((raw - self.mean) / self.std).T
+        features[:, -1] = previous
+        return features
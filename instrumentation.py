@@ -0,0 +1,150 @@
+"""
+    lightweight timing spans and counters for the hot paths of MLTrader, the
+    indicators, and the dash callbacks, exported in the Prometheus text format
+    on a /metrics endpoint of the dash server
+
+    usage:
+        with span("download"):           #timing a block of code
+            ...
+
+        @timed("MLTrader.fit")           #timing every call of a function
+        def fit(...):
+            ...
+
+        count("model_registry.miss")     #counting an event
+"""
+from contextlib import contextmanager
+import functools
+import threading
+import cProfile
+import time
+import os
+
+
+class Metrics:
+    """
+        class for collecting the call count, total time, and max time of each
+        span and the total of each counter (thread-safe, per process)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+
+
+    def observe(self, name, seconds):
+        with self._lock:
+            stats = self.spans.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+
+    def inc(self, name, value = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+
+    def render(self, prefix = "stock_app"):
+        """
+            method returning the metrics in the Prometheus text format
+        """
+        with self._lock:
+            spans = sorted(self.spans.items())
+            counters = sorted(self.counters.items())
+        lines = ["# HELP {}_span_seconds time spent in instrumented code".format(prefix),
+                 "# TYPE {}_span_seconds summary".format(prefix)]
+        for name, (calls, total, _) in spans:
+            lines.append('{}_span_seconds_count{{span="{}"}} {}'.format(prefix, name, calls))
+            lines.append('{}_span_seconds_sum{{span="{}"}} {:.6f}'.format(prefix, name, total))
+        lines += ["# HELP {}_span_seconds_max slowest call of instrumented code".format(prefix),
+                  "# TYPE {}_span_seconds_max gauge".format(prefix)]
+        for name, (_, _, longest) in spans:
+            lines.append('{}_span_seconds_max{{span="{}"}} {:.6f}'.format(prefix, name, longest))
+        lines += ["# HELP {}_events_total number of counted events".format(prefix),
+                  "# TYPE {}_events_total counter".format(prefix)]
+        for name, value in counters:
+            lines.append('{}_events_total{{event="{}"}} {}'.format(prefix, name, value))
+        return "\n".join(lines) + "\n"
+
+
+#metrics shared by the whole process
+metrics = Metrics()
+
+
+@contextmanager
+def span(name):
+    """
+        context manager for timing a block of code under the given span name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(name, time.perf_counter() - start)
+
+
+def timed(name = None):
+    """
+        decorator for timing every call of a function under the given span name
+        (defaults to the function's qualified name)
+    """
+    def decorator(func):
+        span_name = func.__qualname__ if name is None else name
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value = 1):
+    """
+        function for adding to the counter of the given event
+    """
+    metrics.inc(name, value)
+
+
+def register_endpoints(server, profile_dir = None):
+    """
+        function for adding a /metrics endpoint to a Flask server (e.g. the
+        app.server of a Dash app); if the STOCK_APP_PROFILE environment
+        variable is set to 1, a request sent with an "X-Profile: 1" header (or a
+        profile=1 query parameter) is also run under cProfile and its stats are
+        dumped into profile_dir (defaults to a profiles folder in the current
+        working directory)
+    """
+    from flask import Response, request, g
+
+    @server.route("/metrics")
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    if os.environ.get("STOCK_APP_PROFILE") != "1":
+        return
+    profile_dir = os.path.join(os.getcwd(), "profiles") if profile_dir is None else profile_dir
+
+    @server.before_request
+    def start_profile():
+        if request.headers.get("X-Profile") == "1" or request.args.get("profile") == "1":
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @server.after_request
+    def stop_profile(response):
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            file_name = "{}_{}.prof".format(time.strftime("%Y%m%d-%H%M%S"),
+                                            request.path.strip("/").replace("/", "_") or "index")
+            profiler.dump_stats(os.path.join(profile_dir, file_name))
+        return response
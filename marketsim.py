@@ -0,0 +1,99 @@
+#importing dependencies
+import pandas as pd
+import numpy as np
+
+def orders_to_trades(orders_df, prices):
+    """
+        function to turn an orders dataframe (see MLTrader.generate_orders_df)
+        into a wide dataframe of signed trades with the same dates and stocks
+        as the prices
+
+        inputs:
+            orders_df:   dataframe indexed by date containing the Order
+                         (BUY/SELL/HOLD), Shares, and Symbol of each order;
+                         orders for many stocks can be concatenated together
+            prices:      dataframe containing the daily prices of the stocks
+        output:
+            trades:      dataframe containing the number of shares bought (>0)
+                         or sold (<0) of each stock on each trading day
+                         (orders on dates or stocks not in prices are ignored)
+    """
+    sign = orders_df['Order'].map({'BUY': 1, 'SELL': -1, 'HOLD': 0}).fillna(0)
+    signed = pd.DataFrame({'Date': orders_df.index.values,
+                           'Symbol': orders_df['Symbol'].values,
+                           'Shares': (sign * orders_df['Shares']).values})
+    trades = signed.pivot_table(index='Date', columns='Symbol', values='Shares',
+                                aggfunc='sum')
+    return trades.reindex(index=prices.index, columns=prices.columns).fillna(0)
+
+
+def compute_portvals(orders, prices, start_val = 100000, commission = 0.0,
+                     impact = 0.0, symbol = None, per_symbol = False):
+    """
+        function to simulate a portfolio trading the given orders, computing
+        the cash, holdings, and value of each trading day with whole-array
+        operations
+
+        inputs:
+            orders:      dataframe of orders (see generate_orders_df), a Trade
+                         column (see MLTrader.testLearner) for the given symbol,
+                         or a wide dataframe of signed trades per stock
+            prices:      dataframe containing the daily prices of the stocks
+            start_val:   float representing the starting cash
+            commission:  float representing the fixed cost of each trade
+            impact:      float representing the assumed impact of a trade as a
+                         fraction of the traded value
+            symbol:      string representing the stock traded in a Trade column
+                         (defaults to the only stock in prices)
+            per_symbol:  boolean indicating whether to simulate each stock as
+                         its own portfolio starting with start_val cash
+        output:
+            portvals:    dataframe containing the Cash, Holdings Value, and
+                         Portfolio Value of each trading day (one column level
+                         per stock if per_symbol is True)
+            holdings:    dataframe containing the shares held of each stock at
+                         the end of each trading day
+    """
+    if 'Order' in orders.columns:
+        trades = orders_to_trades(orders, prices)
+    elif list(orders.columns) == ['Trade']:
+        #a Trade column for a stock without prices would silently never trade
+        if symbol is None:
+            if len(prices.columns) != 1:
+                raise ValueError("the symbol of the Trade column is needed when prices has "
+                                 "{} stocks".format(len(prices.columns)))
+            symbol = prices.columns[0]
+        elif symbol not in prices.columns:
+            raise ValueError("no prices for {}, the symbol of the Trade column".format(symbol))
+        trades = orders.rename(columns={'Trade': symbol}) \
+                       .reindex(index=prices.index, columns=prices.columns).fillna(0)
+    else:
+        trades = orders.reindex(index=prices.index, columns=prices.columns).fillna(0)
+
+    trades_arr = trades.values.astype(float)
+    prices_arr = prices.values.astype(float)
+
+    #paying (or receiving) the traded value plus the impact and commission of
+    #each trade, and carrying the cash and shares forward day by day
+    traded_value = trades_arr * prices_arr
+    costs = np.abs(traded_value) * impact + commission * (trades_arr != 0)
+    cash_flows = -(traded_value + costs)
+    holdings_arr = np.cumsum(trades_arr, axis=0)
+    stock_values = holdings_arr * prices_arr
+
+    if per_symbol:
+        cash = start_val + np.cumsum(cash_flows, axis=0)
+        portvals = pd.concat({'Cash': pd.DataFrame(cash, index=prices.index, columns=prices.columns),
+                              'Holdings Value': pd.DataFrame(stock_values, index=prices.index,
+                                                             columns=prices.columns),
+                              'Portfolio Value': pd.DataFrame(cash + stock_values, index=prices.index,
+                                                              columns=prices.columns)}, axis=1)
+    else:
+        cash = start_val + np.cumsum(cash_flows.sum(axis=1))
+        stock_value = stock_values.sum(axis=1)
+        portvals = pd.DataFrame({'Cash': cash, 'Holdings Value': stock_value,
+                                 'Portfolio Value': cash + stock_value},
+                                index=prices.index)
+
+    holdings = pd.DataFrame(holdings_arr, index=prices.index, columns=prices.columns)
+    return portvals, holdings
@@ -0,0 +1,170 @@
+"""
+    compact artifact holding the linear models of many stock symbols in one
+    memory-mapped NumPy file, so a process can serve any symbol without
+    unpickling a joblib file per symbol
+"""
+from indicators import INDICATOR_NAMES
+import pandas as pd
+import numpy as np
+import os
+
+#number of features used by MLTrader (the indicators plus the previous price)
+N_FEATURES = len(INDICATOR_NAMES) + 1
+
+def record_dtype(symbol_length):
+    """
+        function returning the dtype of one record per symbol: the window
+        length n, the learner's coefficients and intercept, the
+        StandardScaler's mean and scale, and the indicator normalization
+        statistics; the symbol field is sized to the longest symbol so no
+        symbol is cut short
+    """
+    return np.dtype([('symbol', 'U{}'.format(max(symbol_length, 1))), ('n', 'i4'),
+                     ('coef', 'f8', (N_FEATURES,)), ('intercept', 'f8'),
+                     ('ss_mean', 'f8'), ('ss_scale', 'f8'),
+                     ('stats_mean', 'f8', (len(INDICATOR_NAMES),)),
+                     ('stats_std', 'f8', (len(INDICATOR_NAMES),))])
+
+
+class LinearModel:
+    """
+        class for predicting with the coefficients of a linear learner; has
+        the same predict(X) method as the scikit-learn model it came from
+    """
+
+    def __init__(self, coef, intercept):
+        self.coef_ = coef
+        self.intercept_ = intercept
+
+
+    def predict(self, X):
+        return (np.asarray(X, dtype=float) @ self.coef_ + self.intercept_).reshape(-1, 1)
+
+
+class ScalerParams:
+    """
+        class for scaling prices with the mean and scale of a fitted
+        StandardScaler; has the same transform/inverse_transform methods
+    """
+
+    def __init__(self, mean, scale):
+        self.mean_ = mean
+        self.scale_ = scale
+
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=float) - self.mean_) / self.scale_
+
+
+    def inverse_transform(self, X):
+        return np.asarray(X, dtype=float) * self.scale_ + self.mean_
+
+
+def is_linear(learner):
+    """
+        function returning whether a learner can be stored in the artifact,
+        i.e. it's a linear model of the MLTrader features with one target
+    """
+    coef = getattr(learner, 'coef_', None)
+    return coef is not None and np.size(coef) == N_FEATURES \
+           and np.size(getattr(learner, 'intercept_', 0.0)) == 1
+
+
+def pack_linear_models(symbols, n, folder = None, path = None):
+    """
+        function for packing the joblib models saved by MLTrader.save_learner
+        into one artifact; non-linear learners are skipped and keep being
+        served from their joblib files
+
+        inputs:
+            symbols: list of strings representing the stock symbols
+            n:       integer representing the window length the models were
+                     trained with
+            folder:  string representing the folder of the joblib models
+                     (defaults to the models folder in the current working
+                     directory)
+            path:    string representing the artifact file (defaults to
+                     linear_models.npy in the models folder)
+
+        output:
+            packed:  list of the symbols stored in the artifact
+    """
+    from joblib import load
+    folder = os.path.join(os.getcwd(), "models") if folder is None else folder
+    path = os.path.join(folder, "linear_models.npy") if path is None else path
+
+    records = []
+    for symbol in symbols:
+        learner = load(os.path.join(folder, "{}_model.joblib".format(symbol)))
+        if not is_linear(learner):
+            continue
+        ss = load(os.path.join(folder, "{}_ss.joblib".format(symbol)))
+        stats_path = os.path.join(folder, "{}_stats.joblib".format(symbol))
+        stats_mean = stats_std = np.full(len(INDICATOR_NAMES), np.nan)
+        if os.path.isfile(stats_path):
+            stats = load(stats_path).droplevel(1).reindex(INDICATOR_NAMES)
+            stats_mean, stats_std = stats['mean'].values, stats['std'].values
+        records.append((symbol, n, np.ravel(learner.coef_), np.ravel(learner.intercept_)[0],
+                        ss.mean_[0], ss.scale_[0], stats_mean, stats_std))
+
+    #writing to a temporary file first so readers never map a partial file
+    tmp_path = os.path.join(os.path.dirname(path), "tmp_" + os.path.basename(path))
+    symbol_length = max((len(record[0]) for record in records), default=1)
+    np.save(tmp_path, np.array(records, dtype=record_dtype(symbol_length)))
+    os.replace(tmp_path, path)
+    return [record[0] for record in records]
+
+
+class LinearModelArtifact:
+    """
+        class for reading the models of an artifact written by
+        pack_linear_models through a memory map
+
+        input:
+            path:  string representing the artifact file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        self.records = np.load(path, mmap_mode='r')
+        self.index = {symbol: i for i, symbol in enumerate(self.records['symbol'])}
+
+
+    def __contains__(self, symbol):
+        return symbol in self.index
+
+
+    def window(self, symbol):
+        """
+            method returning the window length n the symbol's model was
+            trained with
+        """
+        return int(self.records[self.index[symbol]]['n'])
+
+
+    def check_window(self, symbol, n):
+        """
+            method raising a ValueError if the symbol's model wasn't trained
+            with the window length n (its features wouldn't line up)
+        """
+        if n is not None and self.window(symbol) != n:
+            raise ValueError("the packed model of {} was trained with n={}, not n={}"
+                             .format(symbol, self.window(symbol), n))
+
+
+    def get(self, symbol, n = None):
+        """
+            method returning the (learner, StandardScaler, indicator stats)
+            triple of a symbol in the same form as ModelRegistry.get; if n is
+            given, a model trained with another window length is rejected
+        """
+        self.check_window(symbol, n)
+        record = self.records[self.index[symbol]]
+        learner = LinearModel(np.array(record['coef']), float(record['intercept']))
+        ss = ScalerParams(float(record['ss_mean']), float(record['ss_scale']))
+        stats = None
+        if not np.isnan(record['stats_mean']).any():
+            stats = pd.DataFrame({'mean': record['stats_mean'], 'std': record['stats_std']},
+                                 index=pd.MultiIndex.from_product([INDICATOR_NAMES, [symbol]]))
+        return learner, ss, stats
@@ -0,0 +1,205 @@
+from collections import OrderedDict
+from model_artifact import LinearModelArtifact
+from instrumentation import count, span
+import threading
+import os
+
+
+class ModelRegistry:
+    """
+        class for keeping loaded learner/StandardScaler/indicator statistics
+        triples in memory so they're only unpickled once; the least recently
+        used triples are dropped once the cache is full, and a triple is
+        reloaded when its files on disk change (e.g. after retraining); linear
+        models packed into the folder's linear_models.npy artifact (see
+        model_artifact.py) are read from it unless their joblib files are newer
+
+        inputs:
+            folder:   string representing the folder the models were saved to
+                      by MLTrader.save_learner (defaults to the models folder
+                      in the current working directory)
+            max_size: integer representing the number of symbols to keep loaded
+
+        the cached objects are shared by every caller, so they should only be
+        used for prediction
+    """
+
+    def __init__(self, folder = None, max_size = 128):
+        self.folder = os.path.join(os.getcwd(), "models") if folder is None else folder
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._artifact = None
+
+
+    def _paths(self, symbol):
+        return (os.path.join(self.folder, "{}_model.joblib".format(symbol)),
+                os.path.join(self.folder, "{}_ss.joblib".format(symbol)),
+                os.path.join(self.folder, "{}_stats.joblib".format(symbol)))
+
+
+    def artifact(self):
+        """
+            method returning the memory-mapped LinearModelArtifact of the
+            models folder (reopened when the file changes) or None
+        """
+        path = os.path.join(self.folder, "linear_models.npy")
+        if not os.path.isfile(path):
+            return None
+        with self._lock:
+            if self._artifact is None or self._artifact.mtime != os.stat(path).st_mtime_ns:
+                self._artifact = LinearModelArtifact(path)
+            return self._artifact
+
+
+    def version(self, symbol):
+        """
+            method returning the version of a symbol's saved model, i.e. the
+            modification times of its model, StandardScaler, and indicator
+            statistics files (the statistics are None for older models), or
+            ("artifact", mtime) if it's served from the linear model artifact
+        """
+        model_path, ss_path, stats_path = self._paths(symbol)
+        artifact = self.artifact()
+        if artifact is not None and symbol in artifact:
+            mtimes = [os.stat(path).st_mtime_ns for path in self._paths(symbol)
+                      if os.path.isfile(path)]
+            if max(mtimes, default=0) <= artifact.mtime:
+                return ("artifact", artifact.mtime)
+        stats_mtime = os.stat(stats_path).st_mtime_ns if os.path.isfile(stats_path) else None
+        return (os.stat(model_path).st_mtime_ns, os.stat(ss_path).st_mtime_ns, stats_mtime)
+
+
+    def get(self, symbol, n = None):
+        """
+            method for getting the learner and StandardScaler of a symbol,
+            loading them from disk if they aren't cached or have changed
+
+            inputs:
+                symbol:  string representing the stock symbol
+                n:       integer representing the window length the caller
+                         predicts with; a packed model trained with another
+                         window length raises a ValueError (joblib models
+                         don't record their window length)
+
+            output:
+                learner: the trained ML object
+                ss:      the fitted StandardScaler object
+                stats:   the indicator normalization statistics (None if the
+                         model was saved without them)
+        """
+        model_path, ss_path, stats_path = self._paths(symbol)
+        mtimes = self.version(symbol)
+        if mtimes[0] == "artifact":
+            self.artifact().check_window(symbol, n)
+        with self._lock:
+            entry = self._cache.get(symbol)
+            if entry is not None and entry[0] == mtimes:
+                self._cache.move_to_end(symbol)
+                count("model_registry.hit")
+                return entry[1]
+
+        #loading outside the lock so other symbols can still be served
+        count("model_registry.miss")
+        with span("ModelRegistry.load"):
+            if mtimes[0] == "artifact":
+                models = self.artifact().get(symbol)
+            else:
+                #importing here so serving packed models never loads joblib
+                from joblib import load
+                models = (load(model_path), load(ss_path),
+                          None if mtimes[2] is None else load(stats_path))
+        with self._lock:
+            self._cache[symbol] = (mtimes, models)
+            self._cache.move_to_end(symbol)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return models
+
+
+    def preload(self, symbols):
+        """
+            method for loading the models of the given symbols ahead of time;
+            symbols without saved models are skipped
+
+            input:
+                symbols: list of strings representing the stock symbols
+
+            output:
+                loaded:  list of the symbols that were loaded
+        """
+        loaded = []
+        for symbol in symbols:
+            try:
+                self.get(symbol)
+                loaded.append(symbol)
+            except FileNotFoundError:
+                pass
+        return loaded
+
+
+    def invalidate(self, symbol = None):
+        """
+            method for dropping one symbol (or every symbol if None) from the
+            cache
+        """
+        with self._lock:
+            if symbol is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(symbol, None)
+
+
+class PredictionCache:
+    """
+        class for caching today's predicted price of each symbol keyed by
+        (symbol, model version, last bar date); a symbol's entry is replaced
+        once a new bar arrives or its model is retrained
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+
+    def get(self, symbol, version, last_bar):
+        """
+            method returning the cached prediction or None if there's no
+            prediction for this model version and last bar
+        """
+        with self._lock:
+            entry = self._entries.get(symbol)
+        if entry is None or entry[:2] != (version, last_bar):
+            count("prediction_cache.miss")
+            return None
+        count("prediction_cache.hit")
+        return entry[2]
+
+
+    def put(self, symbol, version, last_bar, price):
+        with self._lock:
+            self._entries[symbol] = (version, last_bar, price)
+
+
+#model registry and prediction cache shared by MLTrader and the dash app
+_default_registry = None
+_default_prediction_cache = None
+
+def default_registry():
+    """
+        function returning the shared model registry (created on first use)
+    """
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = ModelRegistry()
+    return _default_registry
+
+
+def default_prediction_cache():
+    """
+        function returning the shared prediction cache (created on first use)
+    """
+    global _default_prediction_cache
+    if _default_prediction_cache is None:
+        _default_prediction_cache = PredictionCache()
+    return _default_prediction_cache
@@ -0,0 +1,133 @@
+import pandas as pd
+import numpy as np
+
+
+class PricePanel:
+    """
+        class for holding the closing prices of many stocks in one contiguous
+        float32 (symbols x dates) array with a shared date index; a symbol's
+        prices and a date range of the panel are views of the same memory,
+        so slicing never copies the prices
+
+        inputs:
+            dates:   datetime64[ns] array of the sorted dates (or bar times)
+            values:  2D array of prices with one row per symbol (converted to
+                     float32 only if it isn't already)
+            symbols: list of strings representing the stock symbols in the
+                     order of the rows of values
+    """
+
+    def __init__(self, dates, values, symbols):
+        self.dates = np.asarray(dates).astype('datetime64[ns]', copy=False)
+        self.values = np.asarray(values).astype(np.float32, copy=False)
+        self.symbols = list(symbols)
+        self._rows = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+
+    @classmethod
+    def from_store(cls, store, symbols, sd, ed, refresh = True):
+        """
+            method for reading a panel of the given symbols between sd and ed
+            from a PriceStore (see PriceStore.get_arrays)
+        """
+        symbols = list(dict.fromkeys(symbols))
+        timestamps, closes = store.get_arrays(symbols, sd, ed, refresh=refresh)
+        values = np.empty((len(symbols), len(timestamps)), dtype=np.float32)
+        values[...] = closes.T
+        return cls(timestamps.view('datetime64[ns]'), values, symbols)
+
+
+    @classmethod
+    def from_frame(cls, prices):
+        """
+            method for creating a panel from a wide dataframe of prices indexed
+            by date (or with a Date column)
+        """
+        if 'Date' in prices.columns:
+            prices = prices.set_index('Date')
+        values = np.empty(prices.shape[::-1], dtype=np.float32)
+        values[...] = prices.values.T
+        return cls(prices.index.values, values, prices.columns)
+
+
+    def __len__(self):
+        return len(self.dates)
+
+
+    def __contains__(self, symbol):
+        return symbol in self._rows
+
+
+    def __getitem__(self, symbol):
+        """
+            method returning a view of the prices of one symbol
+        """
+        return self.values[self._rows[symbol]]
+
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.dates.nbytes
+
+
+    def between(self, sd, ed):
+        """
+            method returning a panel viewing the dates from sd up to (but not
+            including) ed, found by binary search on the sorted dates
+        """
+        lo, hi = self.dates.searchsorted([np.datetime64(pd.Timestamp(sd)),
+                                          np.datetime64(pd.Timestamp(ed))])
+        return PricePanel(self.dates[lo:hi], self.values[:, lo:hi], self.symbols)
+
+
+    def fill(self, chunk = 256):
+        """
+            method for forward-filling and then back-filling the missing prices
+            of each symbol in place; symbols are filled chunk rows at a time so
+            the temporary index arrays stay small
+        """
+        if len(self.dates) == 0:
+            return self
+        cols = np.arange(len(self.dates), dtype=np.int32)
+        for lo in range(0, len(self.symbols), chunk):
+            block = self.values[lo:lo+chunk]
+            missing = np.isnan(block)
+            if not missing.any():
+                continue
+            #index of the last valid price at or before each date
+            last = np.where(missing, 0, cols)
+            np.maximum.accumulate(last, axis=1, out=last)
+            block[...] = np.take_along_axis(block, last, axis=1)
+            #prices before the first valid price take the first valid price
+            missing = np.isnan(block)
+            first = np.argmax(~missing, axis=1)
+            rows, dates = np.nonzero(missing)
+            block[rows, dates] = block[rows, first[rows]]
+        return self
+
+
+    def frame(self, symbols = None, dtype = None):
+        """
+            method returning a (dates x symbols) dataframe of the panel for
+            the code working on dataframes; the frame views the panel's memory
+            when the symbols are consecutive rows of the panel (or None for all
+            of them) and dtype is None
+
+            inputs:
+                symbols: list of strings representing the stock symbols
+                dtype:   dtype to convert the prices to (e.g. float to train
+                         in float64)
+
+            output:
+                prices:  dataframe indexed by Date with one column per symbol
+        """
+        symbols = self.symbols if symbols is None else list(symbols)
+        rows = [self._rows[symbol] for symbol in symbols]
+        if rows and rows == list(range(rows[0], rows[0] + len(rows))):
+            values = self.values[rows[0]:rows[0] + len(rows)]
+        else:
+            values = self.values[rows]
+        if dtype is not None:
+            values = values.astype(dtype)
+        return pd.DataFrame(values.T, columns=symbols, copy=False,
+                            index=pd.DatetimeIndex(self.dates, name='Date'))
@@ -0,0 +1,152 @@
+from collections import namedtuple
+from util import pull_prices_viz
+import datetime as dt
+import threading
+import time
+
+
+#price panel plus its sorted date array and per-symbol price views used by
+#the dash callbacks
+PriceSnapshot = namedtuple('PriceSnapshot', ['prices', 'dates', 'series'])
+
+def make_snapshot(prices):
+    """
+        function for building a PriceSnapshot from a PricePanel (e.g. the
+        output of util.pull_prices_viz)
+    """
+    series = {symbol: prices[symbol] for symbol in prices.symbols}
+    return PriceSnapshot(prices, prices.dates, series)
+
+
+class PricesUnavailable(RuntimeError):
+    """
+        error raised when a snapshot is requested before any prices could be
+        loaded (e.g. the cache is empty and the first download failed)
+    """
+
+
+class PriceRefresher:
+    """
+        class for keeping a snapshot of the latest prices up to date in a
+        background thread; the first snapshot is read from the price store's
+        cache without downloading anything (if the cache isn't empty), and
+        each refresh swaps in a whole new snapshot so readers never see a
+        partially updated one
+
+        inputs:
+            symbols:    list of strings representing the stock symbols
+            period:     string representing the period of prices to keep
+                        (see util.pull_prices_viz)
+            interval:   float representing the seconds between refreshes
+            store:      PriceStore to read the prices from (defaults to the
+                        shared store in price_store.py)
+            on_refresh: optional function called with each new snapshot
+                        (e.g. to warm the prediction cache)
+            retry:      float representing the seconds between refreshes
+                        while there is no snapshot yet (capped at interval)
+    """
+
+    def __init__(self, symbols, period = "5y", interval = 3600, store = None,
+                 on_refresh = None, retry = 30):
+        self.symbols = list(symbols)
+        self.period = period
+        self.interval = interval
+        self.retry = retry
+        self.store = store
+        self.on_refresh = on_refresh
+        #time the last refresh finished and how long it took in seconds
+        self.last_refresh = None
+        self.last_duration = None
+        self.last_error = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def snapshot(self):
+        """
+            method returning the current PriceSnapshot; the first call loads
+            the cached prices and starts the background thread
+
+            raises PricesUnavailable if nothing was cached and the first
+            refresh failed (the background thread keeps retrying, see status
+            for the error)
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None and self._thread is None:
+                prices = pull_prices_viz(self.symbols, self.period,
+                                         store=self.store, refresh=False)
+                if len(prices) == 0:
+                    #nothing cached yet, so the first refresh has to block
+                    self.refresh()
+                else:
+                    self._snapshot = make_snapshot(prices)
+                self.start()
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise PricesUnavailable("no prices loaded yet (last refresh error: {})"
+                                    .format(self.last_error))
+        return snapshot
+
+
+    def refresh(self):
+        """
+            method for pulling the latest prices and swapping in the new
+            snapshot
+        """
+        start = time.perf_counter()
+        try:
+            snapshot = make_snapshot(pull_prices_viz(self.symbols, self.period,
+                                                     store=self.store))
+            self._snapshot = snapshot
+            self.last_error = None
+            if self.on_refresh is not None:
+                self.on_refresh(snapshot)
+        except Exception as e:
+            #keeping the old snapshot if the refresh fails
+            self.last_error = "{}: {}".format(type(e).__name__, e)
+        self.last_duration = time.perf_counter() - start
+        self.last_refresh = dt.datetime.now()
+
+
+    def _wait(self):
+        #retrying sooner while there is no snapshot to serve at all
+        return self.interval if self._snapshot is not None else min(self.interval, self.retry)
+
+
+    def _run(self):
+        while not self._stop.is_set():
+            #skipping the refresh if one just happened (e.g. a blocking first
+            #refresh before the thread started)
+            if self.last_refresh is None or (dt.datetime.now() - self.last_refresh) \
+                    .total_seconds() >= self._wait():
+                self.refresh()
+            self._stop.wait(self._wait())
+
+
+    def start(self):
+        """
+            method for starting the background refresh thread (if it isn't
+            already running)
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+
+
+    def status(self):
+        """
+            method returning the time, duration, and error of the last refresh
+        """
+        return {'last_refresh': None if self.last_refresh is None else self.last_refresh.isoformat(),
+                'last_duration': self.last_duration,
+                'last_error': self.last_error}
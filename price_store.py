@@ -0,0 +1,413 @@
+import pandas as pd
+import numpy as np
+import datetime as dt
+import contextlib
+import threading
+import json
+import time
+import os
+from instrumentation import span, count
+
+#minutes in one bar of each supported interval ("1d" is a whole 390 minute
+#trading session)
+BAR_MINUTES = {"1m": 1, "5m": 5, "15m": 15, "30m": 30, "1h": 60, "1d": 390}
+
+#stored days each refresh fetches again to check the stored (adjusted) closes
+#against the provider's (see PriceStore.refresh)
+OVERLAP = pd.Timedelta(days=4)
+
+
+def _tmp_path(path):
+    #temporary file name unique to this process and thread, so concurrent
+    #writers never truncate each other's temporary files
+    folder, name = os.path.split(path)
+    return os.path.join(folder, "tmp_{}_{}_{}".format(os.getpid(), threading.get_ident(), name))
+
+
+def _load(path, mmap_mode):
+    """
+        helper function for loading (or memory-mapping) a .npy file; unlike
+        np.load, the header and the mapped data come from the same open file,
+        so a partition replaced in between can't be mapped with the old header
+    """
+    with open(path, 'rb') as f:
+        if mmap_mode is None:
+            return np.load(f)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if np.prod(shape) == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(f, dtype=dtype, mode=mmap_mode, shape=shape, offset=f.tell(),
+                         order='F' if fortran_order else 'C')
+
+
+@contextlib.contextmanager
+def _locked(folder_path):
+    """
+        helper context manager holding an exclusive lock on a partition (a
+        lock file in its folder) so writers in other threads and processes
+        (e.g. gunicorn workers and the snapshot publisher) merge one at a time
+    """
+    with open(os.path.join(folder_path, ".lock"), 'a+') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.01)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class PriceStore:
+    """
+        class for storing closing prices on disk with one memory-mapped NumPy
+        partition per stock symbol; only the dates that are missing from a
+        partition are fetched when prices are requested
+
+        daily closes are stored as float64 by session date; intraday bars
+        (which have up to 390 times as many rows) are stored as float32 with
+        their int64 (datetime64[ns]) bar start times in UTC; the dates and
+        closes of a partition are one structured array in one file, so a
+        reader never pairs the dates of one write with the closes of another
+
+        inputs:
+            root:     string representing the folder holding the partitions
+                      (defaults to a price_data folder in the current working
+                      directory, with a subfolder per intraday interval)
+            fetcher:  function with the signature fetcher(symbols, sd, ed) that
+                      returns a dataframe of closing prices indexed by date with
+                      one column per symbol (defaults to a util.BulkFetcher of
+                      the interval)
+            interval: string representing the bar interval of the stored
+                      prices, one of BAR_MINUTES
+    """
+
+    def __init__(self, root = None, fetcher = None, interval = "1d"):
+        if interval not in BAR_MINUTES:
+            raise ValueError("interval must be one of {}".format(", ".join(BAR_MINUTES)))
+        self.interval = interval
+        self.intraday = interval != "1d"
+        if root is None:
+            root = os.path.join(os.getcwd(), "price_data")
+            if self.intraday:
+                root = os.path.join(root, interval)
+        self.root = root
+        if fetcher is None:
+            #importing here since util.py imports this module
+            from util import BulkFetcher
+            fetcher = BulkFetcher(interval=interval)
+        self.fetcher = fetcher
+        self.dtype = np.float32 if self.intraday else np.float64
+        self.bar = pd.Timedelta(minutes=BAR_MINUTES[interval])
+
+
+    def completed_until(self):
+        """
+            method returning the (UTC) time before which every intraday bar
+            has closed; later bars are still forming, so they're never stored
+        """
+        return pd.Timestamp.now(tz="UTC").tz_localize(None) - self.bar
+
+
+    def _partition_path(self, symbol):
+        return os.path.join(self.root, symbol)
+
+
+    def _read_meta(self, symbol):
+        """
+            helper method returning the (fetched_from, fetched_through) date
+            range already covered by the symbol's partition or None if the
+            symbol has never been fetched
+        """
+        meta_path = os.path.join(self._partition_path(symbol), "meta.json")
+        if not os.path.isfile(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        return pd.Timestamp(meta['fetched_from']), pd.Timestamp(meta['fetched_through'])
+
+
+    def _write_array(self, path, array):
+        #writing to a temporary file first so readers never see a partial file
+        tmp_path = _tmp_path(path)
+        np.save(tmp_path, array)
+        os.replace(tmp_path, path)
+
+
+    def read(self, symbol, mmap_mode = 'r'):
+        """
+            method for reading the stored dates and closing prices of a symbol
+
+            inputs:
+                symbol:    string representing the stock symbol
+                mmap_mode: memory-map mode passed on to np.load (None reads the
+                           arrays fully into memory)
+
+            output:
+                dates:     datetime64 array of the stored trading days
+                closes:    float array of the stored closing prices
+        """
+        path = os.path.join(self._partition_path(symbol), "prices.npy")
+        if not os.path.isfile(path):
+            return np.array([], dtype='datetime64[ns]'), np.array([], dtype=self.dtype)
+        prices = _load(path, mmap_mode)
+        return prices['date'], prices['close']
+
+
+    def _append(self, symbol, closes, sd, ed, replace = False):
+        """
+            helper method for merging newly fetched closing prices into the
+            symbol's partition and extending its fetched date range (or, with
+            replace, swapping in the new prices and date range for the stored
+            ones)
+        """
+        folder_path = self._partition_path(symbol)
+        os.makedirs(folder_path, exist_ok=True)
+
+        #holding the partition's lock from reading the stored prices until the
+        #metadata is written, so a concurrent writer can't drop this merge
+        with _locked(folder_path):
+            #merging the stored and new prices, keeping the new price on overlaps
+            merged = closes.dropna()
+            if not replace:
+                dates, values = self.read(symbol, mmap_mode=None)
+                stored = pd.Series(values, index=pd.DatetimeIndex(dates))
+                merged = pd.concat([stored, merged])
+            merged = merged[~merged.index.duplicated(keep='last')].sort_index()
+
+            prices = np.empty(len(merged), dtype=[('date', 'datetime64[ns]'),
+                                                  ('close', self.dtype)])
+            prices['date'] = merged.index.values.astype('datetime64[ns]')
+            prices['close'] = merged.values
+            self._write_array(os.path.join(folder_path, "prices.npy"), prices)
+
+            #writing the metadata last so a failed write only causes a refetch
+            covered = self._read_meta(symbol)
+            if covered is not None and not replace:
+                sd, ed = min(sd, covered[0]), max(ed, covered[1])
+            meta = {'fetched_from': sd.isoformat(), 'fetched_through': ed.isoformat()}
+            meta_path = os.path.join(folder_path, "meta.json")
+            tmp_path = _tmp_path(meta_path)
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, meta_path)
+
+
+    def _fetch(self, symbols, sd, ed):
+        """
+            helper method for fetching the closing prices of the symbols
+            between sd and ed from the fetcher with the index in the store's
+            time convention
+        """
+        with span("PriceStore.fetch"):
+            closes = self.fetcher(symbols, sd, ed)
+        count("price_store.fetched_symbols", len(symbols))
+        if closes.index.tz is not None:
+            #keeping the session date of daily closes, and converting the
+            #exchange times of intraday bars to UTC like the refresh cutoff
+            if self.intraday:
+                closes.index = closes.index.tz_convert("UTC").tz_localize(None)
+            else:
+                closes.index = closes.index.tz_localize(None)
+        return closes.loc[(closes.index >= sd) & (closes.index < ed)]
+
+
+    def _rescaled(self, symbol, closes):
+        """
+            helper method returning whether newly fetched (adjusted) closes
+            disagree with the stored closes of the same bars, i.e. a split or
+            dividend re-adjusted the symbol's whole history since it was stored
+        """
+        dates, values = self.read(symbol)
+        lo = np.searchsorted(dates, np.datetime64(closes.index[0]), side='left')
+        hi = np.searchsorted(dates, np.datetime64(closes.index[-1]), side='right')
+        stored = pd.Series(np.array(values[lo:hi]), index=pd.DatetimeIndex(np.array(dates[lo:hi])))
+        common = stored.index.intersection(closes.index)
+        return len(common) > 0 and not np.allclose(stored[common].values, closes[common].values,
+                                                   rtol=1e-4)
+
+
+    def refresh(self, symbols, sd, ed):
+        """
+            method for fetching the dates between sd and ed that are missing
+            from each symbol's partition; symbols missing the same date range
+            are fetched together in one call to the fetcher
+
+            each fetch also covers a few already stored days next to the
+            missing ones: the prices are adjusted closes, which the provider
+            re-adjusts after every split or dividend, so a symbol whose stored
+            closes no longer match the fetched ones is fetched again over its
+            whole date range and replaced; a symbol the fetcher returns no
+            prices for (e.g. a failed download) keeps its old date range, so
+            the missing dates are tried again on the next refresh
+
+            inputs:
+                symbols: list of strings representing the stock symbols
+                sd:      string/datetime representing the first date needed
+                ed:      string/datetime representing the date to stop (exclusive)
+
+            output:
+                None
+        """
+        #today's bar (or the current intraday bar) is never stored since it
+        #won't have a closing price yet; intraday times are in UTC
+        if self.intraday:
+            sd = pd.Timestamp(sd).floor(self.bar)
+            ed = min(pd.Timestamp(ed).ceil(self.bar), self.completed_until())
+        else:
+            today = pd.Timestamp(dt.date.today())
+            sd = pd.Timestamp(sd).normalize()
+            ed = min(pd.Timestamp(ed).ceil('D'), today)
+
+        #grouping the symbols by the date range they're missing (plus the
+        #overlap with the stored days, which spans a long weekend)
+        gaps, coverage = {}, {}
+        for symbol in symbols:
+            covered = coverage[symbol] = self._read_meta(symbol)
+            if covered is None:
+                gaps.setdefault((sd, ed), []).append(symbol)
+                continue
+            if sd < covered[0]:
+                gaps.setdefault((sd, min(covered[0] + OVERLAP, covered[1])), []).append(symbol)
+            if covered[1] < ed:
+                gaps.setdefault((max(covered[1] - OVERLAP, covered[0]), ed), []).append(symbol)
+
+        refetch = {}
+        for (start, end), group in gaps.items():
+            if start >= end:
+                continue
+            closes = self._fetch(group, start, end)
+            for symbol in group:
+                new_closes = closes[symbol].dropna() if symbol in closes.columns \
+                             else pd.Series(dtype=float)
+                if new_closes.empty:
+                    count("price_store.empty_fetches")
+                    continue
+                covered = coverage[symbol]
+                if covered is not None and self._rescaled(symbol, new_closes):
+                    count("price_store.readjusted")
+                    refetch.setdefault((min(start, covered[0]), max(end, covered[1])),
+                                       []).append(symbol)
+                    continue
+                self._append(symbol, new_closes, start, end)
+
+        #replacing the whole history of the re-adjusted symbols
+        for (start, end), group in refetch.items():
+            closes = self._fetch(group, start, end)
+            for symbol in group:
+                if symbol in closes.columns and closes[symbol].notna().any():
+                    self._append(symbol, closes[symbol], start, end, replace=True)
+
+
+    def get(self, symbols, sd, ed, refresh = True):
+        """
+            method for reading the closing prices of the given symbols between
+            sd and ed, fetching any missing dates first
+
+            inputs:
+                symbols: list of strings representing the stock symbols
+                sd:      string/datetime representing the first date to read
+                ed:      string/datetime representing the date to stop reading
+                         (exclusive)
+                refresh: boolean indicating whether to fetch missing dates
+
+            output:
+                prices:  dataframe indexed by date containing one column of
+                         closing prices per symbol (NaN where a symbol didn't
+                         trade)
+        """
+        if refresh:
+            self.refresh(symbols, sd, ed)
+
+        sd, ed = np.datetime64(pd.Timestamp(sd)), np.datetime64(pd.Timestamp(ed))
+        columns = {}
+        for symbol in symbols:
+            #binary searching the memory-mapped dates so only the needed
+            #slice of the partition is read from disk
+            dates, closes = self.read(symbol)
+            lo, hi = np.searchsorted(dates, [sd, ed])
+            columns[symbol] = pd.Series(np.array(closes[lo:hi]),
+                                        index=pd.DatetimeIndex(np.array(dates[lo:hi])))
+        prices = pd.DataFrame(columns, columns=symbols)
+        prices.index.rename('Date', inplace=True)
+        return prices
+
+
+    def get_arrays(self, symbols, sd, ed, refresh = True):
+        """
+            method for reading the closing prices of the given symbols between
+            sd and ed into one 2D array aligned on the union of their bars,
+            without building a pandas object per symbol
+
+            inputs:
+                symbols:    list of strings representing the stock symbols
+                sd:         string/datetime representing the first bar to read
+                ed:         string/datetime representing the bar to stop
+                            reading (exclusive)
+                refresh:    boolean indicating whether to fetch missing bars
+
+            output:
+                timestamps: int64 array of the bar start times in nanoseconds
+                closes:     (bars x symbols) array of closing prices in the
+                            store's dtype (NaN where a symbol didn't trade)
+        """
+        if refresh:
+            self.refresh(symbols, sd, ed)
+
+        sd, ed = np.datetime64(pd.Timestamp(sd)), np.datetime64(pd.Timestamp(ed))
+        slices = []
+        for symbol in symbols:
+            dates, closes = self.read(symbol)
+            lo, hi = np.searchsorted(dates, [sd, ed])
+            slices.append((dates[lo:hi].view('i8'), closes[lo:hi]))
+
+        #placing each symbol's bars into its column of the shared bar index
+        timestamps = np.unique(np.concatenate([t for t, _ in slices])) if slices \
+                     else np.array([], dtype='i8')
+        prices = np.full((len(timestamps), len(symbols)), np.nan, dtype=self.dtype)
+        for i, (symbol_times, closes) in enumerate(slices):
+            prices[np.searchsorted(timestamps, symbol_times), i] = closes
+        return timestamps, prices
+
+
+#price stores (one per bar interval) shared by util.py, MLTrader, and the
+#dash app
+_default_stores = {}
+
+def default_store(interval = "1d"):
+    """
+        function returning the shared price store of the given bar interval
+        (created on first use)
+    """
+    if interval not in _default_stores:
+        _default_stores[interval] = PriceStore(interval=interval)
+    return _default_stores[interval]
+
+
+def set_default_store(store):
+    """
+        function for replacing the shared price store of the store's interval,
+        e.g. with a store using a local fetcher for running offline; passing
+        None resets every shared store
+    """
+    if store is None:
+        _default_stores.clear()
+    else:
+        _default_stores[store.interval] = store
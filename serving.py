@@ -0,0 +1,362 @@
+"""
+    helpers for serving the dash app from several worker processes (see
+    gunicorn.conf.py): one publisher process keeps the latest price snapshot in
+    shared memory, along with today's predicted price of every symbol, for
+    every worker to read, and each worker runs any blocking fetch/predict work
+    left to it in a thread pool that coalesces identical requests
+
+    usage:
+        gunicorn -c gunicorn.conf.py dash_app:server
+"""
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ThreadPoolExecutor
+from price_refresher import make_snapshot, PricesUnavailable
+from price_panel import PricePanel
+from instrumentation import count
+import multiprocessing
+import numpy as np
+import datetime as dt
+import threading
+import signal
+import json
+import time
+import sys
+import os
+
+
+def _write_manifest(path, manifest):
+    #writing to a temporary file first so readers never see a partial manifest
+    tmp_path = os.path.join(os.path.dirname(path), "tmp_" + os.path.basename(path))
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def _attach(name):
+    #attaching without registering the segment with the resource tracker,
+    #which would otherwise unlink it when this worker exits
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+def _snapshot_arrays(shm, n_dates, n_symbols):
+    #dates as int64 nanoseconds followed by the float32 (symbols x dates)
+    #values of the PricePanel, so each symbol's series is a contiguous view
+    dates = np.ndarray((n_dates,), dtype='datetime64[ns]', buffer=shm.buf)
+    values = np.ndarray((n_symbols, n_dates), dtype=np.float32, buffer=shm.buf,
+                        offset=dates.nbytes)
+    return dates, values
+
+
+class SharedSnapshotPublisher:
+    """
+        class for copying each new PriceSnapshot into a shared memory segment
+        and pointing a small json manifest at it (which also holds the
+        snapshot's predicted prices); the previous segment is unlinked once
+        the manifest points at the new one (workers still mapping it keep
+        their pages until they move on)
+
+        input:
+            manifest_path: string representing the manifest file the workers
+                           read (see SharedSnapshotReader)
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self._shm = None
+        self._manifest = None
+        self._lock = threading.Lock()
+
+
+    def publish(self, snapshot, status = None, predictions = None):
+        """
+            method for publishing a snapshot and (optionally) a dictionary
+            mapping symbols to their predicted prices for it
+        """
+        panel = snapshot.prices
+        symbols, n_dates = panel.symbols, len(panel)
+        with self._lock:
+            shm = shared_memory.SharedMemory(create=True,
+                                             size=max(panel.nbytes, 1))
+            dates, values = _snapshot_arrays(shm, n_dates, len(symbols))
+            dates[:] = panel.dates
+            values[...] = panel.values
+            del dates, values
+            self._manifest = {'name': shm.name, 'symbols': symbols, 'n_dates': n_dates,
+                              'published': dt.datetime.now().isoformat(),
+                              'status': status, 'predictions': _prices_dict(predictions)}
+            _write_manifest(self.manifest_path, self._manifest)
+            old, self._shm = self._shm, shm
+        if old is not None:
+            old.close()
+            old.unlink()
+        count("shared_snapshot.published")
+
+
+    def publish_predictions(self, predictions):
+        """
+            method for adding the predicted prices of the current snapshot
+            (without copying its prices again)
+        """
+        with self._lock:
+            if self._manifest is None:
+                return
+            self._manifest = dict(self._manifest, predictions=_prices_dict(predictions))
+            _write_manifest(self.manifest_path, self._manifest)
+        count("shared_snapshot.predictions_published")
+
+
+    def close(self):
+        """
+            method for removing the manifest and unlinking the current segment
+        """
+        with self._lock:
+            if os.path.isfile(self.manifest_path):
+                os.remove(self.manifest_path)
+            if self._shm is not None:
+                self._shm.close()
+                self._shm.unlink()
+                self._shm = None
+
+
+class SharedSnapshotReader:
+    """
+        class for reading the PriceSnapshot published by a
+        SharedSnapshotPublisher in another process; the snapshot's arrays are
+        read-only views of the shared memory, and a new segment is attached
+        whenever the manifest changes
+
+        inputs:
+            manifest_path: string representing the manifest file written by the
+                           publisher
+            timeout:       float representing the seconds to wait for the first
+                           snapshot to be published
+    """
+
+    def __init__(self, manifest_path, timeout = 60):
+        self.manifest_path = manifest_path
+        self.timeout = timeout
+        self._mtime = None
+        self._manifest = None
+        self._snapshot = None
+        #segments of older snapshots that requests may still be reading
+        self._retired = []
+        self._shm = None
+        self._lock = threading.Lock()
+
+
+    def snapshot(self):
+        """
+            method returning the latest published PriceSnapshot
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                mtime = os.stat(self.manifest_path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime is not None and mtime == self._mtime:
+                return self._snapshot
+            if mtime is not None:
+                with self._lock:
+                    try:
+                        if mtime != self._mtime:
+                            self._attach_latest(mtime)
+                        return self._snapshot
+                    except FileNotFoundError:
+                        #the segment was replaced between reading the
+                        #manifest and attaching it, so trying again
+                        pass
+            elif self._snapshot is not None:
+                return self._snapshot
+            if time.monotonic() > deadline:
+                raise PricesUnavailable("no price snapshot published at {}".format(self.manifest_path))
+            time.sleep(0.05)
+
+
+    def _attach_latest(self, mtime):
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        if self._manifest is not None and manifest['name'] == self._manifest['name']:
+            #the same snapshot with its predictions added
+            self._manifest, self._mtime = manifest, mtime
+            return
+        shm = _attach(manifest['name'])
+        symbols = manifest['symbols']
+        dates, values = _snapshot_arrays(shm, manifest['n_dates'], len(symbols))
+        dates.flags.writeable = False
+        values.flags.writeable = False
+
+        if self._shm is not None:
+            self._retired.append(self._shm)
+        self._shm, self._manifest = shm, manifest
+        self._snapshot = make_snapshot(PricePanel(dates, values, symbols))
+        self._mtime = mtime
+        count("shared_snapshot.attached")
+        self._close_retired()
+
+
+    def _close_retired(self):
+        #closing the old segments no request holds a view of anymore
+        still_used = []
+        for shm in self._retired:
+            try:
+                shm.close()
+            except BufferError:
+                still_used.append(shm)
+        self._retired = still_used
+
+
+    def predictions(self):
+        """
+            method returning a dictionary mapping symbols to the predicted
+            prices published with the current snapshot (empty until the
+            publisher has predicted them)
+        """
+        self.snapshot()
+        return (self._manifest or {}).get('predictions') or {}
+
+
+    def status(self):
+        """
+            method returning the publish time and refresh status of the
+            current snapshot
+        """
+        manifest = self._manifest or {}
+        return {'published': manifest.get('published'), 'refresh': manifest.get('status')}
+
+
+def _prices_dict(predictions):
+    #json-friendly copy of a {symbol: predicted price} mapping
+    if predictions is None:
+        return None
+    return {str(symbol): float(price) for symbol, price in predictions.items()}
+
+
+def predict_symbols(symbols, n = 10):
+    """
+        function for predicting today's price of every symbol in one batched
+        pass (see MLTrader.predict_many), or None if that fails, in which case
+        the workers predict the symbols they're asked for themselves
+
+        inputs:
+            symbols:     list of strings representing the stock symbols
+            n:           integer representing the trader's window length
+        output:
+            predictions: dictionary mapping each symbol to its predicted price
+    """
+    from MLTrader import MLTrader
+    try:
+        return MLTrader(None, n=n).predict_many(list(symbols))
+    except Exception:
+        count("shared_snapshot.prediction_errors")
+        return None
+
+
+def run_publisher(manifest_path, symbols, period = "5y", interval = 3600, n = 10):
+    """
+        function for running a publisher process: it keeps a PriceRefresher
+        going and publishes each of its snapshots, with the predicted price of
+        every symbol, until it receives SIGTERM
+
+        inputs:
+            manifest_path: string representing the manifest file to write
+            symbols:       list of strings representing the stock symbols
+            period:        string representing the period of prices to keep
+            interval:      float representing the seconds between refreshes
+            n:             integer representing the window length of the
+                           dash app's trader
+    """
+    from price_refresher import PriceRefresher
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    publisher = SharedSnapshotPublisher(manifest_path)
+    refresher = PriceRefresher(symbols, period, interval=interval,
+                               on_refresh=lambda s: publisher.publish(
+                                   s, refresher.status(), predict_symbols(symbols, n)))
+    try:
+        #the first snapshot comes from the price store's cache when possible
+        #and is published before its predictions, so the workers can draw
+        #the plots right away; if there are no prices yet, the refresher's
+        #retries publish the first
+        try:
+            publisher.publish(refresher.snapshot(), refresher.status())
+            publisher.publish_predictions(predict_symbols(symbols, n))
+        except PricesUnavailable:
+            pass
+        stop.wait()
+    finally:
+        refresher.stop()
+        publisher.close()
+
+
+def start_publisher(manifest_path, symbols, period = "5y", interval = 3600, n = 10):
+    """
+        function for starting run_publisher in a fresh (spawned) process
+
+        output:
+            process: the started multiprocessing Process
+    """
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_publisher, args=(manifest_path, list(symbols), period, interval, n),
+        name="price-snapshot-publisher", daemon=True)
+    process.start()
+    return process
+
+
+class CoalescingExecutor:
+    """
+        class for running blocking work in a thread pool, where concurrent
+        submissions with the same key share one computation (e.g. many users
+        selecting the same ticker)
+
+        input:
+            max_workers: integer representing the number of threads (defaults
+                         to ThreadPoolExecutor's default)
+    """
+
+    def __init__(self, max_workers = None):
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="stock-app")
+        self._futures = {}
+        self._lock = threading.Lock()
+
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+            method returning the future of the in-flight computation for the
+            key, or of a new one running func(*args, **kwargs)
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                count("coalescing.joined")
+                return future
+            future = self._pool.submit(func, *args, **kwargs)
+            self._futures[key] = future
+        count("coalescing.submitted")
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+
+    def run(self, key, func, *args, timeout = None, **kwargs):
+        """
+            method for submitting func and waiting for its result
+        """
+        return self.submit(key, func, *args, **kwargs).result(timeout)
+
+
+    def shutdown(self, wait = True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,54 @@
+#importing dependencies
+import numpy as np
+
+def trade_signals(prices_pred, prices, impact = 0.0, start = 0, max_holdings = 1000):
+    """
+        function to turn predicted prices into buy/sell trades using whole-array
+        operations; on each trading day we buy up to +max_holdings shares if
+        tomorrow's predicted price beats today's price by more than the impact,
+        sell down to -max_holdings shares if it trails by more than the impact,
+        and hold otherwise
+
+        inputs:
+            prices_pred:  array containing the predicted (normalized) price for
+                          each trading day; 2D arrays are treated as one column
+                          per stock
+            prices:       array containing the actual (normalized) price for
+                          each trading day with the same shape as prices_pred
+            impact:       float representing the assumed impact of a trade on
+                          the price of the stock
+            start:        integer representing the first trading day we can
+                          trade on (e.g. to skip backfilled indicators)
+            max_holdings: integer representing the largest long/short position
+        output:
+            trades:       array with the same shape as prices containing the
+                          number of shares traded on each trading day
+            n_trades:     number of days a buy/sell signal was given
+            n_bad:        number of signals where the price moved the other way
+    """
+    prices_pred = np.asarray(prices_pred, dtype=float)
+    prices = np.asarray(prices, dtype=float)
+    trades = np.zeros(prices.shape)
+
+    #comparing tomorrow's predicted price to today's price for each trading
+    #day from start up to (but not including) the last day
+    today = prices[start:-1]
+    tomorrow = prices[start+1:]
+    up = prices_pred[start+1:] > today*(1+impact)
+    down = ~up & (prices_pred[start+1:] < today*(1-impact))
+    signal = up.astype(int) - down.astype(int)
+
+    #the holdings after each day are the last signal carried forward, so we
+    #forward-fill the row of the most recent signal (row 0 is the flat start)
+    rows = np.arange(1, signal.shape[0]+1).reshape((-1,) + (1,)*(signal.ndim-1))
+    last_signal = np.maximum.accumulate(np.where(signal != 0, rows, 0), axis=0)
+    padded = np.concatenate([np.zeros_like(signal[:1]), signal], axis=0)
+    holdings = max_holdings * np.take_along_axis(padded, last_signal, axis=0)
+
+    #trading the difference between consecutive holdings
+    trades[start:-1] = np.diff(holdings, axis=0, prepend=0)
+
+    #counting the total trades and the trades the learner shouldn't have made
+    n_trades = (signal != 0).sum(axis=0)
+    n_bad = ((up & (tomorrow < today)) | (down & (tomorrow > today))).sum(axis=0)
+    return trades, n_trades, n_bad
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import Ridge
+from MLTrader import MLTrader
+from price_store import PriceStore
+
+
+def gbm_prices(n_days = 600, n_symbols = 4, seed = 1):
+    rng = np.random.default_rng(seed)
+    values = 50*np.exp(np.cumsum(rng.normal(0.0003, 0.015, (n_days, n_symbols)), axis=0))
+    return pd.DataFrame(values, index=pd.bdate_range("2016-01-01", periods=n_days, name="Date"),
+                        columns=["S{}".format(i) for i in range(n_symbols)])
+
+
+@pytest.fixture
+def store(tmp_path):
+    #the traders are given prices directly, so nothing is ever fetched
+    return PriceStore(str(tmp_path), lambda symbols, sd, ed: pd.DataFrame())
+
+
+def test_batched_fit_matches_per_symbol_ridge(store):
+    prices = gbm_prices()
+    train, test = prices.iloc[:400], prices.iloc[400:]
+    traders = MLTrader(None, n=10, store=store).fit_many_prices(train, alpha=1.0)
+    assert sorted(traders) == list(prices.columns)
+
+    for symbol in prices.columns:
+        single = MLTrader(Ridge, n=10, kwargs={'alpha': 1.0}, store=store)
+        single.fit_prices(train[[symbol]])
+        batched = traders[symbol]
+        np.testing.assert_allclose(np.ravel(batched.learner.coef_), np.ravel(single.learner.coef_),
+                                   rtol=1e-10, atol=1e-14)
+        np.testing.assert_allclose(batched.learner.intercept_, np.ravel(single.learner.intercept_)[0],
+                                   atol=1e-14)
+        pd.testing.assert_frame_equal(batched.test_prices(test[[symbol]]),
+                                      single.test_prices(test[[symbol]]))
+
+
+@pytest.mark.parametrize("pooled", [False, True])
+def test_symbol_without_prices_is_left_out(store, pooled):
+    prices = gbm_prices()
+    with_missing = prices.assign(EMPTY=np.nan)
+    trader = MLTrader(None, n=10, store=store)
+    traders = trader.fit_many_prices(with_missing, pooled=pooled)
+    assert sorted(traders) == list(prices.columns)
+    assert list(trader.fit_errors) == ["EMPTY"]
+
+    #the other stocks' (or the pooled) coefficients are the ones fit without it
+    #(up to the order of the sums)
+    expected = MLTrader(None, n=10, store=store).fit_many_prices(prices, pooled=pooled)
+    for symbol in prices.columns:
+        coef = traders[symbol].learner.coef_
+        assert np.isfinite(coef).all()
+        np.testing.assert_allclose(coef, expected[symbol].learner.coef_, rtol=1e-10, atol=1e-14)
+        np.testing.assert_allclose(traders[symbol].learner.intercept_,
+                                   expected[symbol].learner.intercept_, atol=1e-14)
@@ -0,0 +1,15 @@
+from benchmarks import check_imports, missing_dependency
+
+
+def test_import_budgets():
+    #entry points missing an optional dependency here (e.g. dash) are skipped
+    results, violations = check_imports(repeat=1)
+    assert violations == []
+    assert any(result['seconds'] is not None for result in results.values())
+
+
+def test_only_missing_dependencies_are_skipped():
+    assert missing_dependency("ModuleNotFoundError: No module named 'dash'") == "dash"
+    assert missing_dependency("ModuleNotFoundError: No module named 'indicators'") is None
+    assert missing_dependency("SyntaxError: invalid syntax") is None
+    assert missing_dependency("ImportError: cannot import name 'x' from 'y'") is None
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from indicators import (INDICATOR_NAMES, StreamingIndicators, _rolling_moments, bollinger_bands,
+                        compute_indicators, indicator_stats, normalize_indicators,
+                        price_sma_ratio, raw_indicators, volatility)
+
+
+def gbm_prices(n_days = 1500, n_symbols = 6, seed = 0):
+    rng = np.random.default_rng(seed)
+    values = 100*np.exp(np.cumsum(rng.normal(0.0005, 0.02, (n_days, n_symbols)), axis=0))
+    #a run of identical prices, where the bollinger bands have no width
+    values[200:230, 1] = values[199, 1]
+    return pd.DataFrame(values, index=pd.bdate_range("2015-01-01", periods=n_days),
+                        columns=["S{}".format(i) for i in range(n_symbols)])
+
+
+@pytest.mark.parametrize("n", [2, 5, 10])
+def test_rolling_moments_match_each_window(n):
+    values = gbm_prices().values
+    mean, std = _rolling_moments(values, n)
+    assert np.isnan(mean[:n-1]).all() and np.isnan(std[:n-1]).all()
+    for t in range(n-1, len(values)):
+        window = values[t-n+1:t+1]
+        np.testing.assert_allclose(mean[t], window.mean(axis=0), rtol=1e-12)
+        np.testing.assert_allclose(std[t], window.std(axis=0, ddof=1), rtol=1e-9, atol=1e-12)
+    #the flat run has a std dev of exactly 0
+    assert (std[199+n-1:230, 1] == 0).all()
+
+
+@pytest.mark.parametrize("n", [5, 10, 20])
+def test_matches_single_stock_functions(n):
+    #pandas' rolling std dev is itself only accurate to ~1e-5 of the band
+    #width for very short windows, so the comparison uses n >= 5 and a
+    #tolerance well above float rounding
+    prices = gbm_prices()
+    indicators = compute_indicators(prices, n)
+    for symbol in prices.columns:
+        single = [price_sma_ratio(prices[[symbol]], n), bollinger_bands(prices[[symbol]], n),
+                  volatility(prices[[symbol]], n)]
+        for name, expected in zip(INDICATOR_NAMES, single):
+            expected = expected[symbol]
+            result = indicators[(name, symbol)].reindex(expected.index)
+            assert (result.isna() == expected.isna()).all()
+            np.testing.assert_allclose(result, expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("n", [2, 5, 10])
+def test_streaming_matches_batch(n):
+    prices = gbm_prices()
+    #more runs of identical prices at levels that don't round nicely
+    prices.iloc[700:740, 2] = 1234.567
+    prices.iloc[900:930, 3] = 3.3333
+    raw = raw_indicators(prices, n)
+    stats = indicator_stats(raw)
+    batch = normalize_indicators(raw, stats)
+
+    stream = StreamingIndicators.from_history(prices.iloc[:150], n, stats)
+    for t in range(150, len(prices)):
+        features = stream.update(prices.values[t])
+        for i, name in enumerate(INDICATOR_NAMES):
+            expected = batch[name].values[t]
+            #NaN exactly where the batch indicators are NaN (e.g. bollinger
+            #bands of a flat run)
+            np.testing.assert_array_equal(np.isnan(features[:,i]), np.isnan(expected))
+            np.testing.assert_allclose(features[:,i], expected, atol=1e-8)
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+from marketsim import compute_portvals
+
+
+def loop_portvals(orders, prices, start_val, commission, impact):
+    #reference simulator applying one order at a time
+    cash, shares, values = start_val, dict.fromkeys(prices.columns, 0), []
+    for date in prices.index:
+        for _, order in orders[orders.index == date].iterrows():
+            sign = {'BUY': 1, 'SELL': -1, 'HOLD': 0}[order['Order']]
+            if sign == 0:
+                continue
+            traded = sign * order['Shares'] * prices.loc[date, order['Symbol']]
+            cash -= traded + abs(traded) * impact + commission
+            shares[order['Symbol']] += sign * order['Shares']
+        values.append(cash + sum(shares[symbol] * prices.loc[date, symbol] for symbol in shares))
+    return pd.Series(values, index=prices.index)
+
+
+@pytest.fixture
+def market():
+    rng = np.random.default_rng(4)
+    dates = pd.bdate_range("2019-01-01", periods=60)
+    prices = pd.DataFrame(30*np.exp(np.cumsum(rng.normal(0, 0.02, (60, 3)), axis=0)),
+                          index=dates, columns=["AAA", "BBB", "CCC"])
+    order_dates = dates[rng.integers(0, 60, 40)]
+    orders = pd.DataFrame({'Order': rng.choice(['BUY', 'SELL', 'HOLD'], 40),
+                           'Shares': rng.integers(1, 200, 40),
+                           'Symbol': rng.choice(prices.columns, 40)},
+                          index=order_dates).sort_index()
+    return orders, prices
+
+
+def test_orders_match_order_by_order_simulation(market):
+    orders, prices = market
+    portvals, _ = compute_portvals(orders, prices, 100000, commission=9.95, impact=0.005)
+    expected = loop_portvals(orders, prices, 100000, 9.95, 0.005)
+    np.testing.assert_allclose(portvals['Portfolio Value'], expected, rtol=1e-12)
+
+
+def test_trade_column_defaults_to_the_only_stock(market):
+    orders, prices = market
+    orders = orders[orders['Symbol'] == "BBB"]
+    prices = prices[["BBB"]]
+    trade = orders['Shares'] * orders['Order'].map({'BUY': 1, 'SELL': -1, 'HOLD': 0})
+    trades = trade.groupby(level=0).sum().to_frame('Trade')
+
+    portvals, holdings = compute_portvals(trades, prices, 100000, commission=0.0, impact=0.005)
+    expected = loop_portvals(orders, prices, 100000, 0.0, 0.005)
+    np.testing.assert_allclose(portvals['Portfolio Value'], expected, rtol=1e-12)
+    assert (holdings["BBB"] != 0).any()
+
+
+def test_trade_column_needs_a_symbol_with_prices(market):
+    orders, prices = market
+    trades = pd.DataFrame({'Trade': 10}, index=prices.index[:3])
+    with pytest.raises(ValueError):
+        compute_portvals(trades, prices)
+    with pytest.raises(ValueError):
+        compute_portvals(trades, prices, symbol="ZZZ")
+    portvals, holdings = compute_portvals(trades, prices, symbol="CCC")
+    assert holdings["CCC"].iloc[-1] == 30 and (holdings[["AAA", "BBB"]].values == 0).all()
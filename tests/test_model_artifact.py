@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import Ridge
+from MLTrader import MLTrader
+from model_artifact import LinearModelArtifact, pack_linear_models
+from model_registry import ModelRegistry
+from price_store import PriceStore
+
+#a symbol longer than the others, which the artifact must not cut short
+SYMBOLS = ["S0", "S1", "VERYLONGSYMBOL.X"]
+
+
+def gbm_prices(n_days = 400, seed = 3):
+    rng = np.random.default_rng(seed)
+    values = 80*np.exp(np.cumsum(rng.normal(0.0004, 0.02, (n_days, len(SYMBOLS))), axis=0))
+    return pd.DataFrame(values, index=pd.bdate_range("2017-01-01", periods=n_days, name="Date"),
+                        columns=SYMBOLS)
+
+
+@pytest.fixture
+def models_folder(tmp_path, monkeypatch):
+    #save_learner writes to the models folder of the working directory
+    monkeypatch.chdir(tmp_path)
+    store = PriceStore(str(tmp_path / "prices"), lambda symbols, sd, ed: pd.DataFrame())
+    prices = gbm_prices()
+    for symbol in SYMBOLS:
+        trader = MLTrader(Ridge, n=10, kwargs={'alpha': 1.0}, store=store)
+        trader.fit_prices(prices[[symbol]].iloc[:300])
+        trader.save_learner(symbol)
+    return str(tmp_path / "models"), store, prices.iloc[300:]
+
+
+def test_packed_models_predict_like_joblib_models(models_folder):
+    folder, store, prices = models_folder
+    trader = MLTrader(None, n=10, store=store)
+    joblib_registry = ModelRegistry(folder)
+    assert joblib_registry.version(SYMBOLS[0])[0] != "artifact"
+    expected = trader._predict_window(prices, {symbol: joblib_registry.get(symbol, 10)
+                                               for symbol in SYMBOLS})
+
+    assert pack_linear_models(SYMBOLS, 10, folder) == SYMBOLS
+    registry = ModelRegistry(folder)
+    assert all(registry.version(symbol)[0] == "artifact" for symbol in SYMBOLS)
+    packed = trader._predict_window(prices, {symbol: registry.get(symbol, 10)
+                                             for symbol in SYMBOLS})
+    for symbol in SYMBOLS:
+        np.testing.assert_allclose(packed[symbol], expected[symbol], rtol=1e-12)
+
+
+def test_long_symbols_are_not_truncated(models_folder):
+    folder = models_folder[0]
+    pack_linear_models(SYMBOLS, 10, folder)
+    artifact = LinearModelArtifact(os.path.join(folder, "linear_models.npy"))
+    assert list(artifact.records['symbol']) == SYMBOLS
+    assert "VERYLONGSYMBOL.X" in artifact and "VERYLONGSY" not in artifact
+
+
+def test_wrong_window_length_is_rejected(models_folder):
+    folder = models_folder[0]
+    pack_linear_models(SYMBOLS, 10, folder)
+    registry = ModelRegistry(folder)
+    assert registry.get(SYMBOLS[0], 10) is registry.get(SYMBOLS[0])
+    with pytest.raises(ValueError, match="n=10, not n=5"):
+        registry.get(SYMBOLS[0], 5)
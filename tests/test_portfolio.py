@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+from MLTrader import MLTrader
+from price_store import PriceStore
+
+
+def gbm_prices(n_days = 700, n_symbols = 5, seed = 2):
+    rng = np.random.default_rng(seed)
+    values = 20*np.exp(np.cumsum(rng.normal(0.0005, 0.025, (n_days, n_symbols)), axis=0))
+    return pd.DataFrame(values, index=pd.bdate_range("2016-01-01", periods=n_days, name="Date"),
+                        columns=["S{}".format(i) for i in range(n_symbols)])
+
+
+@pytest.fixture
+def portfolio_trader(tmp_path):
+    prices = gbm_prices()
+    #the trader is given prices directly, so nothing is ever fetched
+    trader = MLTrader(None, n=10, store=PriceStore(str(tmp_path), lambda symbols, sd, ed: pd.DataFrame()))
+    traders = trader.fit_many_prices(prices.iloc[:350])
+    trader.portfolio = {symbol: (t.learner, t.ss, t.indicator_stats) for symbol, t in traders.items()}
+    return trader, prices.iloc[350:]
+
+
+@pytest.mark.parametrize("max_position", [0.15, 0.25, 1.0])
+def test_exposure_stays_within_capital(portfolio_trader, max_position):
+    trader, prices = portfolio_trader
+    capital = 10000
+    trades = trader.test_portfolio_prices(prices, capital, max_position)
+    holdings = trades.cumsum().values
+    assert (holdings != 0).any()
+
+    #valued at each day's closing prices
+    values = np.abs(holdings) * prices.loc[trades.index].values
+    assert (values.sum(axis=1) <= capital).all()
+    assert (values <= max_position*capital).all()
+
+
+def test_max_shares_clips_positions(portfolio_trader):
+    trader, prices = portfolio_trader
+    unclipped = trader.test_portfolio_prices(prices, 10000, 1.0).cumsum().values
+    holdings = trader.test_portfolio_prices(prices, 10000, 1.0, max_shares=50).cumsum().values
+    assert np.abs(unclipped).max() > 50
+    assert np.abs(holdings).max() == 50
+    #positions keep their direction, only their size is capped
+    assert (np.sign(holdings) == np.sign(unclipped)).all()
+    assert (np.abs(holdings) <= np.abs(unclipped)).all()
+
+
+def test_streamed_predictions_match_the_batch_predictions(portfolio_trader):
+    trader, prices = portfolio_trader
+    _, prices_pred = trader.predict_portfolio(prices)
+    mean = np.array([np.ravel(trader.portfolio[symbol][1].mean_)[0] for symbol in prices.columns])
+    scale = np.array([np.ravel(trader.portfolio[symbol][1].scale_)[0] for symbol in prices.columns])
+    expected = prices_pred.values * scale + mean
+
+    warm_up = 100
+    trader.start_streaming(prices.iloc[:warm_up])
+    for t in range(warm_up, len(prices)):
+        predictions = trader.predict_next(prices.values[t])
+        np.testing.assert_allclose([predictions[symbol] for symbol in prices.columns],
+                                   expected[t - trader.n], rtol=1e-9)
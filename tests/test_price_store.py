@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+from price_store import PriceStore, OVERLAP
+
+
+class LocalFetcher:
+    """
+        fetcher serving a fixed panel of closes and recording each request;
+        symbols in fail are returned without prices once
+    """
+
+    def __init__(self, prices):
+        self.prices = prices
+        self.calls = []
+        self.fail = set()
+
+
+    def __call__(self, symbols, sd, ed):
+        self.calls.append((tuple(symbols), sd, ed))
+        mask = (self.prices.index >= sd) & (self.prices.index < ed)
+        closes = self.prices.loc[mask, [s for s in symbols if s in self.prices.columns]].copy()
+        for symbol in self.fail & set(closes.columns):
+            closes[symbol] = np.nan
+        self.fail = set()
+        return closes
+
+
+@pytest.fixture
+def prices():
+    dates = pd.bdate_range("2019-01-01", "2020-12-31")
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.01, (len(dates), 2)), axis=0)),
+                        index=dates, columns=["S0000", "S0001"])
+
+
+def test_only_missing_ranges_are_fetched(tmp_path, prices):
+    fetcher = LocalFetcher(prices)
+    store = PriceStore(str(tmp_path), fetcher)
+    first = store.get(["S0000", "S0001"], "2019-03-01", "2019-09-01")
+    pd.testing.assert_series_equal(first["S0000"], prices.loc["2019-03-01":"2019-08-31", "S0000"],
+                                   check_names=False, check_freq=False)
+    assert len(fetcher.calls) == 1
+
+    #a covered range needs no fetch at all
+    store.get(["S0000", "S0001"], "2019-04-01", "2019-06-01")
+    assert len(fetcher.calls) == 1
+
+    #extending the end only fetches from the covered end (less the overlap)
+    store.get(["S0000", "S0001"], "2019-03-01", "2019-12-01")
+    symbols, sd, ed = fetcher.calls[-1]
+    assert symbols == ("S0000", "S0001")
+    assert (sd, ed) == (pd.Timestamp("2019-09-01") - OVERLAP, pd.Timestamp("2019-12-01"))
+
+
+def test_gap_before_fetched_from(tmp_path, prices):
+    fetcher = LocalFetcher(prices)
+    store = PriceStore(str(tmp_path), fetcher)
+    store.refresh(["S0000"], "2019-06-01", "2019-09-01")
+    result = store.get(["S0000"], "2019-01-01", "2019-09-01")
+    _, sd, ed = fetcher.calls[-1]
+    assert (sd, ed) == (pd.Timestamp("2019-01-01"), pd.Timestamp("2019-06-01") + OVERLAP)
+    np.testing.assert_array_equal(result["S0000"].values,
+                                  prices.loc["2019-01-01":"2019-08-31", "S0000"].values)
+    assert store._read_meta("S0000") == (pd.Timestamp("2019-01-01"), pd.Timestamp("2019-09-01"))
+
+
+def test_overlapping_merge_keeps_one_price_per_day(tmp_path, prices):
+    fetcher = LocalFetcher(prices)
+    store = PriceStore(str(tmp_path), fetcher)
+    store.refresh(["S0000"], "2019-01-01", "2019-06-01")
+    store.refresh(["S0000"], "2019-03-01", "2019-12-01")
+    dates, closes = store.read("S0000")
+    assert (np.diff(dates.astype('i8')) > 0).all()
+    np.testing.assert_array_equal(closes, prices.loc["2019-01-01":"2019-11-30", "S0000"].values)
+
+
+def test_failed_fetch_is_retried(tmp_path, prices):
+    fetcher = LocalFetcher(prices)
+    fetcher.fail = {"S0000"}
+    store = PriceStore(str(tmp_path), fetcher)
+    store.refresh(["S0000", "S0001"], "2019-01-01", "2019-06-01")
+    #the symbol without prices keeps no date range, the other one does
+    assert store._read_meta("S0000") is None
+    assert store._read_meta("S0001") is not None
+
+    result = store.get(["S0000", "S0001"], "2019-01-01", "2019-06-01")
+    assert fetcher.calls[-1][0] == ("S0000",)
+    assert result["S0000"].notna().sum() == len(prices.loc["2019-01-01":"2019-05-31"])
+
+
+def test_failed_fetch_of_new_days_is_retried(tmp_path, prices):
+    fetcher = LocalFetcher(prices)
+    store = PriceStore(str(tmp_path), fetcher)
+    store.refresh(["S0000"], "2019-01-01", "2019-06-01")
+    fetcher.fail = {"S0000"}
+    store.refresh(["S0000"], "2019-01-01", "2019-09-01")
+    assert store._read_meta("S0000")[1] == pd.Timestamp("2019-06-01")
+    result = store.get(["S0000"], "2019-01-01", "2019-09-01")
+    assert len(result.dropna()) == len(prices.loc["2019-01-01":"2019-08-31"])
+
+
+def test_readjusted_history_is_replaced(tmp_path, prices):
+    fetcher = LocalFetcher(prices)
+    store = PriceStore(str(tmp_path), fetcher)
+    store.refresh(["S0000"], "2019-01-01", "2019-06-01")
+
+    #a 4:1 split re-adjusts every past close at the provider
+    fetcher.prices = prices / 4
+    result = store.get(["S0000"], "2019-01-01", "2019-09-01")
+    np.testing.assert_allclose(result["S0000"].values,
+                               prices.loc["2019-01-01":"2019-08-31", "S0000"].values / 4)
+    assert store._read_meta("S0000") == (pd.Timestamp("2019-01-01"), pd.Timestamp("2019-09-01"))
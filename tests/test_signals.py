@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from signals import trade_signals
+
+
+def reference_signals(prices_pred, prices, impact = 0.0, start = 0, max_holdings = 1000):
+    """
+        the day-by-day loop MLTrader.testLearner used before trade_signals,
+        applied to a 1D series of predicted and actual prices
+    """
+    trades = np.zeros(len(prices))
+    current_holdings = 0
+    n_trades = 0
+    n_bad = 0
+    for i in range(start, len(prices)-1):
+        if prices_pred[i+1] > prices[i]*(1+impact):
+            trades[i] = max_holdings - current_holdings
+            current_holdings = max_holdings
+            n_trades += 1
+            if prices[i+1] < prices[i]:
+                n_bad += 1
+        elif prices_pred[i+1] < prices[i]*(1-impact):
+            trades[i] = -max_holdings - current_holdings
+            current_holdings = -max_holdings
+            n_trades += 1
+            if prices[i+1] > prices[i]:
+                n_bad += 1
+    return trades, n_trades, n_bad
+
+
+def random_prices(rng, shape):
+    prices = np.cumsum(rng.normal(size=shape), axis=0)
+    prices_pred = prices + rng.normal(scale=0.5, size=shape)
+    return prices_pred, prices
+
+
+@pytest.mark.parametrize("impact", [0.0, 0.005, 0.05])
+def test_matches_loop_1d(impact):
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        length = int(rng.integers(1, 60))
+        start = int(rng.integers(0, length + 2))
+        prices_pred, prices = random_prices(rng, length)
+        trades, n_trades, n_bad = trade_signals(prices_pred, prices, impact, start=start)
+        expected = reference_signals(prices_pred, prices, impact, start=start)
+        np.testing.assert_array_equal(trades, expected[0])
+        assert (n_trades, n_bad) == expected[1:]
+
+
+@pytest.mark.parametrize("impact", [0.0, 0.01])
+def test_matches_loop_2d(impact):
+    rng = np.random.default_rng(1)
+    for _ in range(100):
+        length, n_symbols = int(rng.integers(1, 60)), int(rng.integers(1, 6))
+        start = int(rng.integers(0, length + 2))
+        prices_pred, prices = random_prices(rng, (length, n_symbols))
+        trades, n_trades, n_bad = trade_signals(prices_pred, prices, impact, start=start)
+        for j in range(n_symbols):
+            expected = reference_signals(prices_pred[:,j], prices[:,j], impact, start=start)
+            np.testing.assert_array_equal(trades[:,j], expected[0])
+            assert (n_trades[j], n_bad[j]) == expected[1:]
+
+
+def test_no_trades_from_last_day():
+    prices_pred, prices = random_prices(np.random.default_rng(2), 10)
+    for start in (9, 10, 15):
+        trades, n_trades, n_bad = trade_signals(prices_pred, prices, start=start)
+        assert not trades.any()
+        assert n_trades == 0 and n_bad == 0
@@ -1,22 +1,179 @@
 """
-    trains a separate model on each of the first 5 stock ticker's prices for
-    the last 5 years and saves them
+    trains a separate model on each of the stock ticker's prices for the last
+    5 years and saves them; the prices of every ticker are loaded once into a
+    compact float32 PricePanel, and the tickers are spread across a pool of
+    worker processes that all train from that panel
+
+    with --batched, the ridge models of every ticker are solved together in one
+    batched solve instead (see MLTrader.fit_many)
+
+    usage:
+        python train_models.py [--processes 4] [--retries 2] [--tickers file.csv]
+                               [--batched]
 """
 import pandas as pd
 import datetime as dt
+import argparse
+import time
+from multiprocessing import Pool
 from MLTrader import MLTrader
+from price_store import default_store, set_default_store
+from price_panel import PricePanel
+from model_artifact import pack_linear_models
 from dateutil.relativedelta import relativedelta
-from sklearn.linear_model import Ridge
-
-#storing the symbols, starting and ending dates for training the models
-tickers = list(pd.read_csv("yfinance_tickers.csv").Symbol.values)
-end_date =  dt.datetime.today()
-start_date = end_date - relativedelta(years=5)
-
-#looping through the stock symbols, training a model, and saving it
-for symbol in tickers:
-    print(symbol)
-    #generating the indicators from the price data
-    trader = MLTrader(Ridge, n = 10, kwargs={'alpha':0.001, 'random_state':0})
-    trader.fit(symbol, sd=start_date, ed=end_date)
-    trader.save_learner(symbol)
+
+#prices of every ticker shared with the worker processes (see train_models)
+_panel = None
+
+
+def train_symbol(symbol, sd, ed, retries = 2):
+    """
+        function for training and saving the model of one stock symbol,
+        retrying the symbol if training fails
+
+        inputs:
+            symbol:  string representing the stock symbol to train on
+            sd:      datetime representing the first date of training data
+            ed:      datetime representing the date to stop training
+            retries: integer representing the number of retries after the
+                     first failed attempt
+
+        output:
+            result:  dictionary containing the symbol, the number of attempts,
+                     the training time in seconds, and the error (None if the
+                     model was saved)
+    """
+    from sklearn.linear_model import Ridge
+    start = time.perf_counter()
+    error = None
+    for attempt in range(1, retries+2):
+        try:
+            #generating the indicators from the price data (taken from the
+            #shared panel when the worker has one)
+            trader = MLTrader(Ridge, n = 10, kwargs={'alpha':0.001, 'random_state':0})
+            if _panel is not None and symbol in _panel:
+                trader.fit_prices(_panel.between(sd, ed).frame([symbol], dtype=float))
+            else:
+                trader.fit(symbol, sd=sd, ed=ed)
+            trader.save_learner(symbol)
+            error = None
+            break
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+    return {'symbol': symbol, 'attempts': attempt, 'error': error,
+            'seconds': time.perf_counter() - start}
+
+
+def _train_symbol_star(args):
+    return train_symbol(*args)
+
+
+def _init_worker(store, panel):
+    global _panel
+    set_default_store(store)
+    _panel = panel
+
+
+def train_models(symbols, sd, ed, processes = None, retries = 2, store = None):
+    """
+        function for training a model for each stock symbol in a pool of
+        worker processes
+
+        inputs:
+            symbols:   list of strings representing the stock symbols
+            sd:        datetime representing the first date of training data
+            ed:        datetime representing the date to stop training
+            processes: integer representing the number of worker processes
+                       (defaults to the number of CPUs)
+            retries:   integer representing the number of retries per symbol
+            store:     PriceStore shared by the workers (defaults to the
+                       shared store in price_store.py)
+
+        output:
+            results:   list of the result dictionaries from train_symbol
+    """
+    #pulling the prices of every symbol (and SPY for the trading days) in one
+    #bulk load into a panel that the workers share (copy-on-write when the
+    #pool forks its workers)
+    store = default_store() if store is None else store
+    panel = PricePanel.from_store(store, list(symbols) + ["SPY"], sd, ed).fill()
+
+    results = []
+    jobs = [(symbol, sd, ed, retries) for symbol in symbols]
+    with Pool(processes, initializer=_init_worker, initargs=(store, panel)) as pool:
+        for result in pool.imap_unordered(_train_symbol_star, jobs):
+            status = "ok" if result['error'] is None else result['error']
+            print("{:<8} {:>7.2f}s  attempts={}  {}".format(
+                result['symbol'], result['seconds'], result['attempts'], status))
+            results.append(result)
+    return results
+
+
+def train_models_batched(symbols, sd, ed, store = None):
+    """
+        function for training the ridge model of every stock symbol in one
+        batched solve and saving them
+
+        inputs:
+            symbols:   list of strings representing the stock symbols
+            sd:        datetime representing the first date of training data
+            ed:        datetime representing the date to stop training
+            store:     PriceStore to read the prices from (defaults to the
+                       shared store in price_store.py)
+
+        output:
+            results:   list of result dictionaries like train_models, except
+                       that the symbols aren't timed one by one: 'seconds' is
+                       None and 'batch_seconds' is the time of the whole batch
+    """
+    start = time.perf_counter()
+    store = default_store() if store is None else store
+    panel = PricePanel.from_store(store, list(symbols) + ["SPY"], sd, ed).fill()
+    trader = MLTrader(None, n = 10, store = store)
+    traders = trader.fit_many_prices(panel.frame(symbols, dtype=float), alpha=0.001)
+    results = []
+    for symbol in symbols:
+        #reporting the symbols left out of the solve (e.g. without prices)
+        #instead of saving NaN models for them
+        if symbol in traders:
+            traders[symbol].save_learner(symbol)
+        results.append({'symbol': symbol, 'attempts': 1,
+                        'error': trader.fit_errors.get(symbol), 'seconds': None})
+    batch_seconds = time.perf_counter() - start
+    for result in results:
+        result['batch_seconds'] = batch_seconds
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="train a model per stock ticker")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="number of retries for a failed ticker")
+    parser.add_argument("--tickers", default="yfinance_tickers.csv",
+                        help="csv file with a Symbol column")
+    parser.add_argument("--batched", action="store_true",
+                        help="solve every ticker's ridge model in one batched solve")
+    args = parser.parse_args()
+
+    #storing the symbols, starting and ending dates for training the models
+    tickers = list(pd.read_csv(args.tickers).Symbol.values)
+    end_date =  dt.datetime.today()
+    start_date = end_date - relativedelta(years=5)
+
+    start = time.perf_counter()
+    if args.batched:
+        results = train_models_batched(tickers, start_date, end_date)
+    else:
+        results = train_models(tickers, start_date, end_date,
+                               processes=args.processes, retries=args.retries)
+    failed = [r['symbol'] for r in results if r['error'] is not None]
+    print("trained {} of {} models in {:.2f}s".format(
+        len(results) - len(failed), len(results), time.perf_counter() - start))
+    if failed:
+        print("failed: {}".format(' '.join(failed)))
+
+    #packing the linear models into one memory-mapped artifact for serving
+    packed = pack_linear_models([r['symbol'] for r in results if r['error'] is None], n=10)
+    print("packed {} linear models into models/linear_models.npy".format(len(packed)))
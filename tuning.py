@@ -0,0 +1,238 @@
+"""
+    hyperparameter search over MLTrader's learner class, learner kwargs, and
+    window length n; each symbol's trials run in a pool of worker processes
+    that share one price panel, the features of each n are computed once per
+    symbol and reused by every learner/kwargs trial, and a symbol's search
+    stops early once its trials stop improving
+
+    the best configuration of each symbol is refit on all of its prices and
+    saved with MLTrader.save_learner (note that the dash app predicts with
+    n=10, so only models searched with n=10 can be served by it)
+
+    usage:
+        python tuning.py [--tickers file.csv] [--n 10] [--processes 4]
+                         [--patience 10] [--metric mse] [--no-save]
+"""
+import pandas as pd
+import numpy as np
+import datetime as dt
+import argparse
+import time
+from multiprocessing import Pool
+from MLTrader import MLTrader
+from signals import trade_signals
+from backtest import pnl
+from price_store import default_store
+from price_panel import PricePanel
+from dateutil.relativedelta import relativedelta
+
+
+class FeatureCache:
+    """
+        class for computing the train/validation features of one stock once
+        per window length n and handing them to every trial with that n
+
+        inputs:
+            train: dataframe containing the training prices of the stock
+            val:   dataframe containing the validation prices of the stock
+    """
+
+    def __init__(self, train, val):
+        self.train = train
+        self.val = val
+        self._features = {}
+
+
+    def get(self, n):
+        """
+            method returning the (X_train, y_train, X_val, y_val) arrays of
+            the window length n; the StandardScaler and indicator statistics
+            are fit on the training prices only
+        """
+        if n not in self._features:
+            trader = MLTrader(None, n=n)
+            X_train, y_train = trader.train_features(self.train)
+            val_norm, X_val = trader.test_features(self.val)
+            self._features[n] = (X_train, y_train[:,0], X_val, val_norm.values[:,0])
+        return self._features[n]
+
+
+def trial_configs(param_grid):
+    """
+        function for listing the (n, learner, kwargs) configurations of a
+        search grid in the order they're tried
+
+        input:
+            param_grid: dictionary with a list of window lengths under "n" and
+                        a list of (learner class, list of kwargs dictionaries)
+                        pairs under "learners"
+
+        output:
+            configs:    list of (n, learner, kwargs) tuples
+    """
+    return [(n, learner, kwargs) for n in param_grid.get('n', [9])
+            for learner, kwargs_list in param_grid['learners']
+            for kwargs in kwargs_list]
+
+
+#price data shared by the tasks of each worker process
+_panel = None
+
+def _init_worker(panel):
+    global _panel
+    _panel = panel
+
+
+def _search_symbol(task):
+    """
+        helper function for running the trials of one symbol in order until
+        patience trials in a row don't improve its best score, then refitting
+        and saving the best configuration
+    """
+    symbol, configs, sd, split, ed, metric, patience, min_delta, save = task
+    prices = _panel.between(sd, ed).frame([symbol], dtype=float)
+    train = prices.loc[prices.index < split]
+    val = prices.loc[prices.index >= split]
+    cache = FeatureCache(train, val)
+
+    results, best, stale = [], None, 0
+    for n, learner, kwargs in configs:
+        start = time.perf_counter()
+        row = {'symbol': symbol, 'n': n, 'learner': learner.__name__, 'kwargs': kwargs}
+        try:
+            X_train, y_train, X_val, y_val = cache.get(n)
+            model = learner(**kwargs)
+            model.fit(X_train, y_train)
+            y_pred = np.ravel(model.predict(X_val))
+        except (TypeError, ValueError) as e:
+            #recording configurations the learner can't be trained with (e.g.
+            #kwargs it doesn't accept, or a symbol without prices)
+            row.update({'mse': np.nan, 'pnl': np.nan, 'score': np.nan,
+                        'seconds': time.perf_counter() - start,
+                        'error': "{}: {}".format(type(e).__name__, e)})
+            results.append(row)
+            continue
+        mse = float(np.mean((y_pred - y_val)**2))
+        trades, _, _ = trade_signals(y_pred, y_val, start=n)
+        profit = float(pnl(trades, val[symbol].values[n:]))
+        score = mse if metric == 'mse' else -profit
+        row.update({'mse': mse, 'pnl': profit, 'score': score,
+                    'seconds': time.perf_counter() - start, 'error': None})
+        results.append(row)
+
+        #stopping once patience trials in a row miss the best score by more
+        #than min_delta
+        if best is None or score < best[0] - min_delta * abs(best[0]):
+            best, stale = (score, n, learner, kwargs), 0
+        else:
+            stale += 1
+            if patience is not None and stale >= patience:
+                break
+
+    if save and best is not None:
+        _, n, learner, kwargs = best
+        trader = MLTrader(learner, n=n, kwargs=kwargs)
+        trader.fit_prices(prices)
+        trader.save_learner(symbol)
+    return results
+
+
+def search(symbols, param_grid, sd, ed, val_months = 6, metric = 'mse', patience = None,
+           min_delta = 0.0, processes = None, store = None, save = True):
+    """
+        function for searching the best MLTrader configuration of each symbol
+
+        inputs:
+            symbols:    list of strings representing the stock symbols
+            param_grid: dictionary with "n" and "learners" (see trial_configs)
+            sd:         string/datetime representing the first date of data
+            ed:         string/datetime representing the date to stop (exclusive)
+            val_months: integer representing the length of the validation
+                        window at the end of the data
+            metric:     "mse" to minimize the validation error of the
+                        normalized prices or "pnl" to maximize the validation
+                        profit of the trades
+            patience:   integer representing the number of trials in a row
+                        without improvement after which a symbol's search stops
+                        (None runs every trial)
+            min_delta:  float representing the relative improvement of the
+                        best score that counts as an improvement
+            processes:  integer representing the number of worker processes
+                        (defaults to the number of CPUs)
+            store:      PriceStore to read the prices from (defaults to the
+                        shared store in price_store.py)
+            save:       boolean indicating whether to save the best model of
+                        each symbol with MLTrader.save_learner
+
+        output:
+            best:       dataframe with the best trial of each symbol
+            results:    dataframe with one row per trial that was run (with the
+                        error of the trials that failed)
+    """
+    if metric not in ('mse', 'pnl'):
+        raise ValueError("metric must be 'mse' or 'pnl'")
+    sd, ed = pd.Timestamp(sd), pd.Timestamp(ed)
+    split = ed - relativedelta(months=val_months)
+
+    #reading in the price data of every symbol (and SPY for the trading days)
+    #once for all the workers
+    store = default_store() if store is None else store
+    panel = PricePanel.from_store(store, list(symbols) + ["SPY"], sd, ed).fill()
+
+    configs = trial_configs(param_grid)
+    tasks = [(symbol, configs, sd, split, ed, metric, patience, min_delta, save)
+             for symbol in symbols]
+    with Pool(processes, initializer=_init_worker, initargs=(panel,)) as pool:
+        results = pd.DataFrame([row for rows in pool.imap_unordered(_search_symbol, tasks)
+                                for row in rows])
+    if results.empty:
+        return results, results
+
+    #symbols whose every trial failed have no best trial
+    scored = results.dropna(subset=['score'])
+    best = scored.loc[scored.groupby('symbol')['score'].idxmin()].reset_index(drop=True)
+    return best, results
+
+
+if __name__ == "__main__":
+    from sklearn.linear_model import Ridge, Lasso
+    from sklearn.ensemble import RandomForestRegressor
+
+    parser = argparse.ArgumentParser(description="search the best model per stock ticker")
+    parser.add_argument("--tickers", default="yfinance_tickers.csv",
+                        help="csv file with a Symbol column")
+    parser.add_argument("--n", type=int, nargs="+", default=[10],
+                        help="window lengths to search (the dash app uses 10)")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--patience", type=int, default=None,
+                        help="trials without improvement before a ticker stops")
+    parser.add_argument("--metric", choices=["mse", "pnl"], default="mse",
+                        help="validation metric to optimize")
+    parser.add_argument("--no-save", action="store_true",
+                        help="only report the best configurations")
+    args = parser.parse_args()
+
+    param_grid = {
+        'n': args.n,
+        'learners': [
+            (Ridge, [{'alpha': alpha, 'random_state': 0} for alpha in [1e-3, 1e-2, 1e-1, 1.0]]),
+            (Lasso, [{'alpha': alpha, 'random_state': 0} for alpha in [1e-4, 1e-3]]),
+            (RandomForestRegressor, [{'n_estimators': 100, 'max_depth': depth, 'random_state': 0}
+                                     for depth in [3, 6]]),
+        ],
+    }
+    tickers = list(pd.read_csv(args.tickers).Symbol.values)
+    end_date = dt.datetime.today()
+    start_date = end_date - relativedelta(years=5)
+
+    start = time.perf_counter()
+    best, results = search(tickers, param_grid, start_date, end_date,
+                           metric=args.metric, patience=args.patience,
+                           processes=args.processes, save=not args.no_save)
+    print(best[['symbol', 'n', 'learner', 'kwargs', 'mse', 'pnl']].to_string(index=False))
+    print("ran {} trials in {:.2f}s".format(len(results), time.perf_counter() - start))
+    if not results.empty and results['error'].notna().any():
+        print("{} trials failed:".format(results['error'].notna().sum()))
+        print(results.loc[results['error'].notna(), ['symbol', 'n', 'learner', 'kwargs', 'error']]
+              .to_string(index=False))
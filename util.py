@@ -1,12 +1,306 @@
 import pandas as pd
 import numpy as np
 import datetime as dt
+import urllib.parse
+import http.client
+import functools
+import threading
+import queue
+import time
+import io
 import os
-import matplotlib.pyplot as plt
-import yfinance as yf
+from dateutil.relativedelta import relativedelta
+from price_store import default_store
+from price_panel import PricePanel
+from instrumentation import span, count
+from concurrent.futures import ThreadPoolExecutor
 
 
-def pull_prices(symbol, sd, ed):
+def period_start(period, end_date = None):
+    """
+        helper function for converting a yfinance-style period string into
+        the date the period starts
+
+        inputs:
+            period:     string representing the period of time (e.g. "5d",
+                        "1mo", "5y", or "max")
+            end_date:   datetime the period ends on (defaults to today)
+
+        output:
+            start_date: datetime representing the start of the period
+    """
+    end_date = dt.datetime.today() if end_date is None else end_date
+    if period == "max":
+        return dt.datetime(1970, 1, 1)
+    if period.endswith("mo"):
+        return end_date - relativedelta(months=int(period[:-2]))
+    qty, unit = int(period[:-1]), period[-1]
+    if unit == "d":
+        return end_date - relativedelta(days=qty)
+    return end_date - relativedelta(years=qty)
+
+
+class FetchError(Exception):
+    """
+        exception raised by a price backend for a failed request; status is
+        the HTTP status (None for connection errors) and retry_after the
+        seconds the server asked to wait before retrying (if any)
+    """
+
+    def __init__(self, message, status = None, retry_after = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class YFinanceBackend:
+    """
+        price backend downloading the adjusted closing prices of one symbol
+        per request from Yahoo! Finance (yfinance keeps its own HTTP
+        connections, so its sessions are empty)
+    """
+
+    #yfinance requests each symbol separately (on threads of its own unless
+    #told otherwise), so BulkFetcher sends it one symbol at a time to rate
+    #limit and retry every request
+    batch_size = 1
+
+    def open_session(self):
+        return None
+
+
+    def __call__(self, session, symbols, sd, ed, interval = "1d"):
+        #importing here so the fetch layer can be used offline with another
+        #backend
+        import yfinance as yf
+        if interval != "1d":
+            #intraday times are UTC (see PriceStore), while yfinance reads
+            #naive times in the exchange's time zone
+            sd, ed = [pd.Timestamp(t).tz_localize("UTC") if pd.Timestamp(t).tz is None
+                      else pd.Timestamp(t) for t in (sd, ed)]
+        df = yf.download(symbols, start=sd, end=ed, interval=interval, auto_adjust=True,
+                         threads=False)
+        closes = df['Close']
+        #yfinance drops the symbol level when only one symbol is requested
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(symbols[0])
+        return closes
+
+
+class HTTPBackend:
+    """
+        price backend reading closing prices from an HTTP price service (or a
+        local stand-in, see benchmarks.serve_panel) over keep-alive
+        connections; a request is
+
+            GET <base_url>/prices?symbols=A,B&start=<iso>&end=<iso>&interval=1d
+
+        and the response is a csv with a Date column and one column of closing
+        prices per symbol
+
+        inputs:
+            base_url: string representing the url of the price service
+            timeout:  float representing the seconds to wait for a response
+    """
+
+    def __init__(self, base_url, timeout = 30):
+        url = urllib.parse.urlsplit(base_url)
+        self.https = url.scheme == "https"
+        self.host = url.netloc
+        self.path = url.path.rstrip("/") + "/prices"
+        self.timeout = timeout
+
+
+    def open_session(self):
+        connection = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return connection(self.host, timeout=self.timeout)
+
+
+    def __call__(self, session, symbols, sd, ed, interval = "1d"):
+        query = urllib.parse.urlencode({'symbols': ",".join(symbols),
+                                        'start': pd.Timestamp(sd).isoformat(),
+                                        'end': pd.Timestamp(ed).isoformat(),
+                                        'interval': interval})
+        try:
+            session.request("GET", "{}?{}".format(self.path, query))
+            response = session.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            #dropping the broken connection; the next request reconnects
+            session.close()
+            raise FetchError("{}: {}".format(type(e).__name__, e))
+        if response.status != 200:
+            retry_after = response.getheader("Retry-After")
+            raise FetchError("HTTP {} from {}".format(response.status, self.host),
+                             response.status,
+                             float(retry_after) if retry_after else None)
+        closes = pd.read_csv(io.BytesIO(body), index_col=0)
+        closes.index = pd.to_datetime(closes.index)
+        closes.columns = closes.columns.astype(str)
+        return closes
+
+
+class RateLimiter:
+    """
+        class for spacing out requests so at most rate of them start per
+        second across all threads
+    """
+
+    def __init__(self, rate):
+        self.spacing = 0.0 if not rate else 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.spacing
+        if start > now:
+            time.sleep(start - now)
+
+
+class BulkFetcher:
+    """
+        class for fetching the closing prices of many symbols through one
+        backend: requests run on a small thread pool, are rate limited and
+        retried with exponential backoff, and concurrent calls asking for the
+        same (symbol, date range) share one request; backends that accept
+        several symbols per request (HTTPBackend) also get batches of up to
+        batch_size symbols and a pool of keep-alive connections, while a
+        YFinanceBackend is sent one symbol per request; it has the
+        fetcher(symbols, sd, ed) signature of PriceStore
+
+        inputs:
+            backend:     price backend (defaults to an HTTPBackend of the
+                         STOCK_APP_PRICE_URL environment variable if it's set,
+                         else a YFinanceBackend)
+            interval:    string representing the bar interval to fetch
+            batch_size:  integer representing the most symbols per request
+                         (capped by the backend's own batch_size, if any)
+            pool_size:   integer representing the number of concurrent
+                         requests (and pooled sessions)
+            rate:        float representing the most requests started per
+                         second (None for no limit)
+            retries:     integer representing the retries of a failed request
+            backoff:     float representing the seconds before the first retry
+                         (doubled for each further retry)
+    """
+
+    def __init__(self, backend = None, interval = "1d", batch_size = 100, pool_size = 4,
+                 rate = 2.0, retries = 3, backoff = 1.0):
+        if backend is None:
+            url = os.environ.get("STOCK_APP_PRICE_URL")
+            backend = HTTPBackend(url) if url else YFinanceBackend()
+        self.backend = backend
+        self.interval = interval
+        self.batch_size = min(batch_size, getattr(backend, 'batch_size', batch_size))
+        self.pool_size = pool_size
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self._start()
+
+
+    def _start(self):
+        #the thread pool, sessions, and locks belong to one process, so
+        #they're created here rather than pickled (see __getstate__)
+        self._limiter = RateLimiter(self.rate)
+        self._pool = ThreadPoolExecutor(self.pool_size, thread_name_prefix="price-fetch")
+        self._sessions = queue.LifoQueue()
+        for _ in range(self.pool_size):
+            self._sessions.put(None)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+
+    def __getstate__(self):
+        #leaving out the thread pool, sessions, and locks so a PriceStore
+        #using this fetcher can be sent to spawned worker processes
+        return {key: value for key, value in self.__dict__.items()
+                if key not in ('_limiter', '_pool', '_sessions', '_in_flight', '_lock')}
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._start()
+
+
+    def __call__(self, symbols, sd, ed):
+        """
+            method for fetching the closing prices of the given symbols between
+            sd and ed (exclusive)
+
+            output:
+                closes: dataframe indexed by date with one column per symbol
+                        the backend returned prices for
+        """
+        sd, ed = pd.Timestamp(sd), pd.Timestamp(ed)
+        futures, batches = {}, []
+        with self._lock:
+            new = []
+            for symbol in dict.fromkeys(symbols):
+                future = self._in_flight.get((symbol, sd, ed))
+                if future is None:
+                    new.append(symbol)
+                else:
+                    count("fetch.deduplicated")
+                    futures[symbol] = future
+            for i in range(0, len(new), self.batch_size):
+                batch = new[i:i+self.batch_size]
+                future = self._pool.submit(self._fetch_batch, batch, sd, ed)
+                for symbol in batch:
+                    self._in_flight[(symbol, sd, ed)] = future
+                    futures[symbol] = future
+                batches.append((batch, future))
+        for batch, future in batches:
+            future.add_done_callback(functools.partial(self._forget, batch, sd, ed))
+
+        columns = {}
+        for symbol, future in futures.items():
+            closes = future.result()
+            if symbol in closes.columns:
+                columns[symbol] = closes[symbol]
+        if not columns:
+            return pd.DataFrame(index=pd.DatetimeIndex([]))
+        return pd.DataFrame(columns)
+
+
+    def _forget(self, batch, sd, ed, future):
+        with self._lock:
+            for symbol in batch:
+                if self._in_flight.get((symbol, sd, ed)) is future:
+                    del self._in_flight[(symbol, sd, ed)]
+
+
+    def _fetch_batch(self, symbols, sd, ed):
+        session = self._sessions.get()
+        try:
+            if session is None:
+                session = self.backend.open_session()
+            for attempt in range(self.retries + 1):
+                self._limiter.wait()
+                try:
+                    with span("BulkFetcher.request"):
+                        closes = self.backend(session, symbols, sd, ed, self.interval)
+                    count("fetch.requests")
+                    count("fetch.symbols", len(symbols))
+                    return closes
+                except Exception as e:
+                    count("fetch.errors")
+                    if attempt == self.retries:
+                        raise
+                    #waiting as long as the server asked or backing off
+                    #exponentially
+                    retry_after = getattr(e, 'retry_after', None)
+                    time.sleep(retry_after if retry_after is not None
+                               else self.backoff * 2**attempt)
+        finally:
+            self._sessions.put(session)
+
+
+def pull_prices(symbol, sd, ed, store = None):
     """
         helper method for reading in and preprocessing the prices data
 
@@ -14,49 +308,99 @@ def pull_prices(symbol, sd, ed):
             symbol: string representing the stock symbol for trading
             sd:     string representing the date to start trading
             ed:     string representing the date to stop trading
+            store:  PriceStore to read the prices from (defaults to the shared
+                    store in price_store.py)
 
         output:
             prices: dataframe containing the preprocessed daily price data
                     for the given stock
     """
-    #reading in the stock data using util.py and removing nulls
-    df = yf.download(symbol, start=sd, end=ed,
-                     group_by="ticker", auto_adjust=True)
-    prices = df.filter(items=['Close'],axis=1)
-    prices.columns = [symbol]
+    #reading in the stock data from the price store and removing nulls
+    store = default_store() if store is None else store
+    prices = store.get([symbol], sd, ed)
     prices.fillna(method='ffill', inplace=True) #forward-filling missing prices
     prices.fillna(method='bfill', inplace=True) #back-filling missing prices
     return prices
     
-def pull_prices_viz(symbols, period="5y"):
+def pull_prices_viz(symbols, period="5y", store = None, refresh = True):
     """
         helper method for reading in and preprocessing the prices data
 
         inputs:
             symbols: string representing the stock symbols for trading
             period:  string representing the period of time to pull the stock 
-                     price for (e.g. "1m" for the last month)
+                     price for (e.g. "1mo" for the last month)
+            store:   PriceStore to read the prices from (defaults to the shared
+                     store in price_store.py)
+            refresh: boolean indicating whether to fetch missing dates (False
+                     only reads what's already cached)
 
         output:
-            prices:  dataframe containing the preprocessed daily price data
-                     for the given stock
+            prices:  PricePanel containing the preprocessed daily price data
+                     for the given stocks
     """
-    #reading in the stock data using util.py and removing nulls
-    df = yf.download(symbols, period="5y", auto_adjust=True)
-    
-    #dropping "today's closing price" 
-    #(at run-time, there typically won't be a closing price for today)
-    df = df.iloc[:-1,:]
-    
-    #pushing date from the index to a column and filling NaNs
-    prices = df['Close'].reset_index()
-    prices.fillna(method='ffill', inplace=True) #forward-filling missing prices
-    prices.fillna(method='bfill', inplace=True) #back-filling missing prices
-    return prices
+    #reading in the stock data from the price store; the store never holds
+    #"today's closing price" since there typically won't be one at run-time
+    store = default_store() if store is None else store
+    if isinstance(symbols, str):
+        symbols = symbols.split()
+    end_date = dt.datetime.today()
+    prices = PricePanel.from_store(store, symbols, period_start(period, end_date),
+                                   end_date, refresh=refresh)
+
+    #forward-filling and back-filling missing prices in place
+    return prices.fill()
     
 
+def lttb(x, y, threshold):
+    """
+        helper function for downsampling a series to a fixed number of points
+        with the Largest-Triangle-Three-Buckets algorithm, which keeps the
+        visual shape of the line (peaks and troughs) for plotting
+
+        inputs:
+            x:         sorted array of x values (numbers or datetime64)
+            y:         array of y values
+            threshold: integer representing the number of points to keep
+
+        output:
+            x_sampled: array of the kept x values
+            y_sampled: array of the kept y values
+    """
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    #comparing areas on numeric x values (dates become integer timestamps)
+    x_num = x.astype('int64').astype(float) if np.issubdtype(x.dtype, np.datetime64) \
+            else x.astype(float)
+
+    #splitting the points between the first and last into threshold-2 buckets
+    #and keeping the point of each bucket that makes the largest triangle with
+    #the last kept point and the average of the next bucket
+    edges = np.linspace(1, n-1, threshold-1).astype(int)
+    kept = np.zeros(threshold, dtype=int)
+    kept[-1] = n-1
+    a = 0
+    for i in range(threshold-2):
+        lo, hi = edges[i], edges[i+1]
+        if i+2 < len(edges):
+            avg_x = x_num[hi:edges[i+2]].mean()
+            avg_y = y[hi:edges[i+2]].mean()
+        else:
+            avg_x, avg_y = x_num[n-1], y[n-1]
+        area = np.abs((x_num[a] - avg_x) * (y[lo:hi] - y[a])
+                      - (x_num[a] - x_num[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        kept[i+1] = a
+    return x[kept], y[kept]
+
+
 #function for normalizing and plotting the given data
 def plot_winnings(df, plot_name, labels, long_list = [], short_list = []):
+    #importing here so only plotting loads matplotlib
+    import matplotlib.pyplot as plt
     #normalizing the data
     df_norm = df / df.iloc[0,:]
     #plotting the normalized data